@@ -0,0 +1,474 @@
+# bench.py (end-to-end preorder benchmark against fake Sellpass / Hoodpay / CapSolver)
+#
+#   python bench.py --users 50 --rounds 3
+#   python bench.py --users 50 --payment crypto --sellpass-latency 0.3
+#   python bench.py --payment crypto --error-rate 0.1 --stall-rate 0.05
+#
+# Every simulated user logs in (email, captcha, OTP) and then places `rounds`
+# preorders through /preorder, the variant button, the amount message and either
+# the balance button or the crypto + coin buttons. Upstreams are local fakes with
+# configurable latency; crypto payments are confirmed by the fake Hoodpay through
+# the signed payment webhook. Reports p50/p99 per step and orders per second.
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+import jwt
+from aiohttp import web, ClientSession
+from loadtest import FakeBotApi, command_update, percentile, wait_for_webhook, launch_bot
+from webhook import send_sample_event
+
+SHOP_ID = "bench"
+PRODUCT_ID = "1"
+WEBHOOK_SECRET = "bench-hoodpay-secret"
+DEFAULT_VARIANTS = [("725392", "BUFFPAL BRUTE [MIXED]"), ("735730", "BUFFPAL BRUTE [CH]"), ("737067", "BUFFPAL BRUTE [AT]")]
+COINS = ["coin_LTC", "coin_USDT_TRX", "coin_USDT_ETH", "coin_BTC", "coin_ETH", "coin_TRX"]
+
+
+class FakeUpstream:
+    # error_rate of requests get a 503 and stall_rate hang for `stall` seconds,
+    # to exercise retries, hedging and the circuit breakers.
+    def __init__(self, name, latency, error_rate=0.0, stall_rate=0.0, stall=0.0):
+        self.name = name
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.calls = collections.Counter()
+        self.runner = None
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    @web.middleware
+    async def faults(self, request, handler):
+        if random.random() < self.error_rate:
+            self.calls["injected_error"] += 1
+            return web.json_response({"errors": ["Injected failure"]}, status=503)
+        if random.random() < self.stall_rate:
+            self.calls["injected_stall"] += 1
+            await asyncio.sleep(self.stall)
+        return await handler(request)
+
+    def routes(self, app):
+        raise NotImplementedError
+
+    async def start(self, port):
+        app = web.Application(middlewares=[self.faults])
+        self.routes(app)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+class FakeSellpass(FakeUpstream):
+    # Serves both the shop API (/self/...) and the customer API used for login and top-ups.
+    def __init__(self, latency, variants, balance):
+        super().__init__("sellpass", latency)
+        self.variants = variants
+        self.balance = balance
+        self.customers = {}
+        self.customer_ids = itertools.count(1_000_000)
+        self.orders_charged = 0
+        self.charged_at = []
+
+    def routes(self, app):
+        app.router.add_get(f"/self/{SHOP_ID}/v2/products/{PRODUCT_ID}", self.product)
+        app.router.add_get(f"/self/{SHOP_ID}/customers", self.customer)
+        app.router.add_post(f"/self/{SHOP_ID}/customers/{{customer_id}}/balance/{{action}}", self.change_balance)
+        app.router.add_get(f"/self/{SHOP_ID}/invoices/{{invoice_id}}", self.invoice)
+        app.router.add_post(f"/{SHOP_ID}/customers/auth/otp/request/", self.otp_request)
+        app.router.add_post(f"/{SHOP_ID}/customers/auth/otp/login/", self.otp_login)
+        app.router.add_post(f"/{SHOP_ID}/customers/dashboard/balance/topup", self.topup)
+
+    def customer_record(self, email):
+        if email not in self.customers:
+            self.customers[email] = {"id": next(self.customer_ids), "email": email, "balance": self.balance}
+        return self.customers[email]
+
+    async def product(self, request):
+        self.calls["product"] += 1
+        await self.delay()
+        variants = [
+            {"id": int(variant_id), "title": title, "priceDetails": {"amount": 0.4},
+             "asSerials": {"stock": 0, "minAmount": 1, "maxAmount": 1000}}
+            for variant_id, title in self.variants
+        ]
+        return web.json_response({"data": {"product": {"variants": variants}}})
+
+    async def customer(self, request):
+        self.calls["customer"] += 1
+        await self.delay()
+        record = self.customer_record(request.query["email"].lower())
+        customer = {
+            "id": record["id"],
+            "customer": {"email": record["email"]},
+            "customerForShopAccount": {"balances": [{"realBalance": record["balance"], "manualBalance": 0}]},
+        }
+        return web.json_response({"data": [customer]})
+
+    async def change_balance(self, request):
+        action = request.match_info["action"]
+        self.calls[f"balance_{action}"] += 1
+        await self.delay()
+        customer_id = int(request.match_info["customer_id"])
+        amount = (await request.json())["amount"]
+        record = next((r for r in self.customers.values() if r["id"] == customer_id), None)
+        if record is None:
+            return web.json_response({"errors": ["Customer not found"]}, status=404)
+        if action == "remove":
+            if record["balance"] < amount:
+                return web.json_response({"errors": ["Insufficient balance"]}, status=400)
+            record["balance"] -= amount
+            self.orders_charged += 1
+            self.charged_at.append(time.perf_counter())
+        else:
+            record["balance"] += amount
+        return web.json_response({"data": None})
+
+    async def invoice(self, request):
+        self.calls["invoice"] += 1
+        await self.delay()
+        invoice_id = request.match_info["invoice_id"]
+        hoodpay_id = f"hp-{invoice_id}"
+        return web.json_response({"data": {"forHoodpayInfo": {
+            "externalUrl": f"https://checkout.hoodpay.io/{hoodpay_id}", "externalPaymentId": hoodpay_id}}})
+
+    async def otp_request(self, request):
+        self.calls["otp_request"] += 1
+        await self.delay()
+        return web.json_response({"data": None})
+
+    async def otp_login(self, request):
+        self.calls["otp_login"] += 1
+        await self.delay()
+        body = await request.json()
+        self.customer_record(body["email"].lower())
+        token = jwt.encode({"sub": body["email"], "exp": int(time.time()) + 86400}, "bench-signing-key-for-local-tests", algorithm="HS256")
+        return web.json_response({"data": token})
+
+    async def topup(self, request):
+        self.calls["topup"] += 1
+        await self.delay()
+        return web.json_response({"data": str(uuid.uuid4())})
+
+
+class FakeHoodpay(FakeUpstream):
+    # A payment counts as paid `pay_after` seconds after a coin is picked; the signed
+    # webhook is sent then, and the hosted page reports COMPLETED from then on.
+    def __init__(self, latency, pay_after, webhook_url):
+        super().__init__("hoodpay", latency)
+        self.pay_after = pay_after
+        self.webhook_url = webhook_url
+        self.paid_at = {}
+        self.tasks = set()
+
+    def routes(self, app):
+        app.router.add_get("/v1/public/payments/hosted-page/{hoodpay_id}", self.status)
+        app.router.add_post("/v1/public/payments/hosted-page/{hoodpay_id}/select-payment-method", self.select)
+
+    async def status(self, request):
+        self.calls["status"] += 1
+        await self.delay()
+        paid_at = self.paid_at.get(request.match_info["hoodpay_id"])
+        status = "COMPLETED" if paid_at and time.monotonic() >= paid_at else "AWAITING_PAYMENT"
+        return web.json_response({"data": {"status": status}})
+
+    async def select(self, request):
+        self.calls["select"] += 1
+        await self.delay()
+        hoodpay_id = request.match_info["hoodpay_id"]
+        body = await request.json()
+        coin = body.get("xPub_Crypto") or body.get("direct_Crypto")
+        self.paid_at[hoodpay_id] = time.monotonic() + self.pay_after
+        task = asyncio.create_task(self.confirm(hoodpay_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return web.json_response({"data": {
+            "chargeCryptoAmount": "0.0123", "chargeCryptoName": coin, "chargeCryptoAddress": f"addr-{hoodpay_id[:12]}"}})
+
+    async def confirm(self, hoodpay_id):
+        await asyncio.sleep(self.pay_after)
+        self.calls["webhook"] += 1
+        try:
+            await send_sample_event(self.webhook_url, WEBHOOK_SECRET, hoodpay_id)
+        except Exception as e:
+            print(f"webhook for {hoodpay_id} failed: {e!r}")
+
+
+class FakeCapSolver(FakeUpstream):
+    def __init__(self, latency, solve_time):
+        super().__init__("capsolver", latency)
+        self.solve_time = solve_time
+        self.tasks = {}
+        self.task_ids = itertools.count(1)
+
+    def routes(self, app):
+        app.router.add_post("/createTask", self.create)
+        app.router.add_post("/getTaskResult", self.result)
+
+    async def create(self, request):
+        self.calls["createTask"] += 1
+        await self.delay()
+        task_id = str(next(self.task_ids))
+        self.tasks[task_id] = time.monotonic() + self.solve_time * random.uniform(0.5, 1.5)
+        return web.json_response({"errorId": 0, "taskId": task_id})
+
+    async def result(self, request):
+        self.calls["getTaskResult"] += 1
+        await self.delay()
+        task_id = (await request.json())["taskId"]
+        if time.monotonic() >= self.tasks.get(task_id, 0):
+            return web.json_response({"errorId": 0, "status": "ready", "solution": {"gRecaptchaResponse": f"token-{task_id}"}})
+        return web.json_response({"errorId": 0, "status": "processing"})
+
+
+def load_json(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+
+
+def seed_files(workdir, orders, invoices):
+    # Grow the real files (or a built-in record when they are missing) to the requested
+    # size, so the storage paths see production-shaped data at the scale being tested.
+    here = os.path.dirname(os.path.abspath(__file__))
+    real_orders = load_json(os.path.join(here, "preorders.json"))
+    real_invoices = load_json(os.path.join(here, "crypto_invoices.json"))
+    order_templates = real_orders or [{
+        "user_id": 1, "username": "seed", "variant_id": DEFAULT_VARIANTS[0][0], "variant_title": DEFAULT_VARIANTS[0][1],
+        "quantity": 1, "payment_method": "balance", "timestamp": "2024-11-24T11:54:40", "invoice_id": "", "delivered": True}]
+    invoice_templates = real_invoices or [{
+        "email": "seed@example.com", "customer_id": 1, "invoice_id": "", "sellpass_id": "", "hoodpay_id": "",
+        "hoodpay_url": "", "variant_id": DEFAULT_VARIANTS[0][0], "variant_title": DEFAULT_VARIANTS[0][1], "amount": 1,
+        "total_price": 0.4, "user_id": 1, "username": "seed", "payment_method": "LITECOIN",
+        "timestamp": "2024-10-09T19:03:22", "status": "EXPIRED"}]
+
+    seeded_orders = []
+    for i in range(orders):
+        order = dict(order_templates[i % len(order_templates)])
+        order["invoice_id"] = f"Seed-{i:08d}"
+        seeded_orders.append(order)
+    seeded_invoices = []
+    for i in range(invoices):
+        invoice = dict(invoice_templates[i % len(invoice_templates)])
+        invoice["invoice_id"] = f"SeedInv-{i:08d}"
+        invoice["hoodpay_id"] = f"seed-hp-{i:08d}"
+        # Seeded invoices must not be picked up by the poller.
+        if invoice["status"] == "AWAITING_PAYMENT":
+            invoice["status"] = "EXPIRED"
+        seeded_invoices.append(invoice)
+
+    with open(os.path.join(workdir, "preorders.json"), "w") as f:
+        json.dump(seeded_orders, f, indent=4)
+    with open(os.path.join(workdir, "crypto_invoices.json"), "w") as f:
+        json.dump(seeded_invoices, f, indent=4)
+
+    variants = list(dict.fromkeys((o["variant_id"], o["variant_title"]) for o in real_orders)) or DEFAULT_VARIANTS
+    return variants
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                "text": "",
+            },
+        },
+    }
+
+
+def variant_token(variant_id):
+    return f"pv:{int(variant_id):010d}"
+
+
+def user_flow(user_id, rounds, variants, payment, update_ids):
+    # (step name, update, number of bot replies that complete the step)
+    steps = [
+        ("start", command_update(next(update_ids), user_id, "/start"), 1),
+        ("login", command_update(next(update_ids), user_id, "/login"), 1),
+        ("email", command_update(next(update_ids), user_id, f"user{user_id}@bench.test"), 2),
+        ("otp", command_update(next(update_ids), user_id, "123456"), 2),
+    ]
+    for round in range(rounds):
+        variant_id = variants[(user_id + round) % len(variants)][0]
+        steps.append(("preorder", command_update(next(update_ids), user_id, "/preorder"), 1))
+        steps.append(("variant", callback_update(next(update_ids), user_id, variant_token(variant_id)), 1))
+        steps.append(("amount", command_update(next(update_ids), user_id, str(random.randint(1, 20))), 1))
+        if payment == "balance":
+            steps.append(("balance", callback_update(next(update_ids), user_id, "balance"), 1))
+        else:
+            steps.append(("crypto", callback_update(next(update_ids), user_id, "crypto"), 1))
+            steps.append(("coin", callback_update(next(update_ids), user_id, random.choice(COINS)), 1))
+    return steps
+
+
+async def drive(api, webhook_url, secret, flows, timeout):
+    latencies = collections.defaultdict(list)
+    failures = collections.Counter()
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+
+    async def run_user(session, user_id, steps):
+        for name, update, replies in steps:
+            waiters = [api.expect_reply(user_id) for _ in range(replies)]
+            started = time.perf_counter()
+            async with session.post(webhook_url, json=update, headers=headers) as res:
+                await res.read()
+            try:
+                done = await asyncio.wait_for(asyncio.gather(*waiters), timeout)
+            except asyncio.TimeoutError:
+                # The rest of this user's flow depends on this step.
+                failures[name] += 1
+                return
+            latencies[name].append(max(done) - started)
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(run_user(session, user_id, steps) for user_id, steps in flows.items()))
+    return latencies, failures, started
+
+
+def report(latencies, failures, elapsed, orders, orders_elapsed, upstreams, busy):
+    print(f"{'step':<10}{'count':>7}{'fail':>6}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    everything = []
+    for name, values in latencies.items():
+        everything.extend(values)
+        print(f"{name:<10}{len(values):>7}{failures[name]:>6}{percentile(values, 0.5) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}{max(values) * 1000:>10.1f}")
+    if everything:
+        print(f"{'all':<10}{len(everything):>7}{sum(failures.values()):>6}{percentile(everything, 0.5) * 1000:>10.1f}"
+              f"{percentile(everything, 0.99) * 1000:>10.1f}{max(everything) * 1000:>10.1f}")
+    print(f"wall time: {elapsed:.2f}s  orders charged: {orders}  orders/s: {orders / orders_elapsed if orders_elapsed else 0:.1f}")
+    print(f"busy / unavailable replies: {busy}")
+    for upstream in upstreams:
+        print(f"{upstream.name} calls: {dict(upstream.calls)}")
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    variants = seed_files(workdir, args.seed_orders, args.seed_invoices)
+    secret = "bench-secret"
+    ports = iter(range(args.base_port, args.base_port + 10))
+    api_port, bot_port, hoodpay_webhook_port, metrics_port, sellpass_port, hoodpay_port, capsolver_port = (next(ports) for _ in range(7))
+
+    api = FakeBotApi()
+    sellpass = FakeSellpass(args.sellpass_latency, variants, args.balance)
+    hoodpay = FakeHoodpay(args.hoodpay_latency, args.pay_after, f"http://127.0.0.1:{hoodpay_webhook_port}/hoodpay/webhook")
+    capsolver = FakeCapSolver(args.capsolver_latency, args.solve_time)
+    upstreams = [sellpass, hoodpay, capsolver]
+    for upstream in upstreams:
+        if upstream.name in args.fault_upstreams.split(","):
+            upstream.error_rate, upstream.stall_rate, upstream.stall = args.error_rate, args.stall_rate, args.stall
+    await api.start(api_port)
+    await sellpass.start(sellpass_port)
+    await hoodpay.start(hoodpay_port)
+    await capsolver.start(capsolver_port)
+
+    env = {
+        "SHOP_ID": SHOP_ID,
+        "PRODUCT_ID": PRODUCT_ID,
+        "SHOP_API_KEY": "bench",
+        "CAPSOLVER_KEY": "bench",
+        "SELLPASS_API_URL": f"http://127.0.0.1:{sellpass_port}",
+        "SELLPASS_STORE_API_URL": f"http://127.0.0.1:{sellpass_port}",
+        "HOODPAY_API_URL": f"http://127.0.0.1:{hoodpay_port}",
+        "CAPSOLVER_API_URL": f"http://127.0.0.1:{capsolver_port}",
+        "HOODPAY_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        "HOODPAY_WEBHOOK_HOST": "127.0.0.1",
+        "HOODPAY_WEBHOOK_PORT": str(hoodpay_webhook_port),
+        "HOODPAY_WEBHOOK_PATH": "/hoodpay/webhook",
+        "METRICS_PORT": str(metrics_port),
+        "STORE_BACKEND": args.store,
+        "CAPTCHA_POOL_SIZE": str(args.captcha_pool),
+        "RATE_LIMITS": args.rate_limits,
+    }
+    process = launch_bot(workdir, api_port, bot_port, secret, env)
+    webhook_url = f"http://127.0.0.1:{bot_port}/telegram"
+    update_ids = itertools.count(1)
+    flows = {10_000 + user: user_flow(10_000 + user, args.rounds, variants, args.payment, update_ids) for user in range(args.users)}
+    expected_orders = args.users * args.rounds
+    try:
+        await wait_for_webhook(api, webhook_url, process)
+        if args.restart:
+            # Stop the bot once every user has picked a variant, then finish the flows on a fresh process.
+            latencies, failures, started = await drive(api, webhook_url, secret, {user: steps[:6] for user, steps in flows.items()}, args.timeout)
+            process.terminate()
+            process.wait()
+            restarted = time.perf_counter()
+            api.webhook_set.clear()
+            process = launch_bot(workdir, api_port, bot_port, secret, env)
+            await wait_for_webhook(api, webhook_url, process)
+            print(f"restart to serving: {time.perf_counter() - restarted:.2f}s")
+            more_latencies, more_failures, _ = await drive(api, webhook_url, secret, {user: steps[6:] for user, steps in flows.items()}, args.timeout)
+            for name, values in more_latencies.items():
+                latencies[name].extend(values)
+            failures.update(more_failures)
+        else:
+            latencies, failures, started = await drive(api, webhook_url, secret, flows, args.timeout)
+        # Crypto orders are charged when the payment webhook arrives, after the last reply.
+        deadline = time.perf_counter() + args.pay_after + args.timeout
+        while sellpass.orders_charged < expected_orders - sum(failures.values()) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - started
+        orders_elapsed = (sellpass.charged_at[-1] - started) if sellpass.charged_at else 0
+        busy = sum(1 for texts in api.texts.values() for text in texts if text and text.startswith(("⏳ Busy", "⚠️ The shop")))
+        report(latencies, failures, elapsed, sellpass.orders_charged, orders_elapsed, upstreams, busy)
+        print(f"metrics were at http://127.0.0.1:{metrics_port}/metrics")
+    finally:
+        process.terminate()
+        process.wait()
+        for server in [api] + upstreams:
+            await server.stop()
+        print(f"bot output: {os.path.join(workdir, 'bot_output.txt')}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the login and preorder flow against fake upstreams.")
+    parser.add_argument("--users", type=int, default=20, help="concurrent users")
+    parser.add_argument("--rounds", type=int, default=3, help="preorders per user")
+    parser.add_argument("--payment", choices=("balance", "crypto"), default="balance")
+    parser.add_argument("--store", choices=("sqlite", "journal", "json"), default="sqlite")
+    parser.add_argument("--seed-orders", type=int, default=2000)
+    parser.add_argument("--seed-invoices", type=int, default=1000)
+    parser.add_argument("--balance", type=float, default=1_000_000)
+    parser.add_argument("--sellpass-latency", type=float, default=0.1)
+    parser.add_argument("--hoodpay-latency", type=float, default=0.1)
+    parser.add_argument("--capsolver-latency", type=float, default=0.05)
+    parser.add_argument("--solve-time", type=float, default=2.0, help="seconds CapSolver takes per captcha")
+    parser.add_argument("--captcha-pool", type=int, default=2)
+    parser.add_argument("--rate-limits", default="", help="RATE_LIMITS for the bot; per-user limits are off by default")
+    parser.add_argument("--fault-upstreams", default="sellpass,hoodpay", help="upstreams that get the injected faults below")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream requests answered with 503")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="share of upstream requests that hang for --stall seconds")
+    parser.add_argument("--stall", type=float, default=20.0)
+    parser.add_argument("--restart", action="store_true", help="restart the bot mid-flow, after the variant is picked")
+    parser.add_argument("--pay-after", type=float, default=1.0, help="seconds until a crypto payment is confirmed")
+    parser.add_argument("--base-port", type=int, default=8190)
+    parser.add_argument("--timeout", type=float, default=30)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
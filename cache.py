@@ -0,0 +1,148 @@
+# cache.py (in-process caches for upstream lookups)
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+VARIANT_TOKEN_PREFIX = "pv:"
+
+
+class VariantCache:
+    # Serves the variant list for `ttl` seconds, then keeps serving it for another
+    # `stale_ttl` seconds while a single background refresh replaces it.
+    def __init__(self, fetch, ttl, stale_ttl):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.variants = None
+        self.by_id = {}
+        self.fetched_at = 0
+        self.refreshing = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    async def get(self):
+        age = time.monotonic() - self.fetched_at
+        if self.variants is not None and age < self.ttl:
+            self.hits += 1
+            return self.variants
+        if self.variants is not None and age < self.ttl + self.stale_ttl:
+            self.stale_hits += 1
+            self._start_refresh()
+            return self.variants
+        self.misses += 1
+        return await self.refresh()
+
+    async def refresh(self):
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self):
+        if self.refreshing is None or self.refreshing.done():
+            self.refreshing = asyncio.create_task(self._refresh())
+        return self.refreshing
+
+    async def _refresh(self):
+        self.refreshes += 1
+        try:
+            variants = await self.fetch()
+        except Exception:
+            logger.exception("Variant refresh failed")
+            variants = []
+        # The fetcher returns an empty list on upstream errors; keep the old list for stale readers.
+        if not variants:
+            self.failures += 1
+            return []
+        self.variants = variants
+        self.by_id = {str(variant['id']): variant for variant in variants}
+        self.fetched_at = time.monotonic()
+        return variants
+
+    # Callback tokens are "pv:" plus the zero-padded variant id, so keyboards only
+    # carry a fixed 13 bytes and prices are always read back from our own table.
+    def token(self, variant):
+        return f"{VARIANT_TOKEN_PREFIX}{int(variant['id']):010d}"
+
+    def parse_token(self, data):
+        # The variant id in a well-formed token, or None.
+        if not isinstance(data, str) or not data.startswith(VARIANT_TOKEN_PREFIX):
+            return None
+        digits = data[len(VARIANT_TOKEN_PREFIX):]
+        if len(digits) != 10 or not digits.isdigit():
+            return None
+        return str(int(digits))
+
+    def resolve_token(self, data):
+        # Only meaningful once the list is loaded; callers await get() first.
+        variant_id = self.parse_token(data)
+        return self.by_id.get(variant_id) if variant_id else None
+
+    def is_stale_token(self, data):
+        # Decided by format alone, so a cold cache after a restart doesn't
+        # reject buttons for variants that still exist.
+        if not isinstance(data, str):
+            return False
+        if data.startswith("preordero,"):
+            return True
+        return data.startswith(VARIANT_TOKEN_PREFIX) and self.parse_token(data) is None
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "age": round(time.monotonic() - self.fetched_at, 1) if self.variants is not None else None,
+        }
+
+
+class CustomerCache:
+    # Customer ids never change and are kept for good. Customer records (which
+    # carry the balance) expire after `balance_ttl` seconds, or as soon as we
+    # add or remove balance for that customer.
+    def __init__(self, fetch, balance_ttl):
+        self.fetch = fetch
+        self.balance_ttl = balance_ttl
+        self.ids = {}
+        self.records = {}
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, email):
+        key = email.lower()
+        cached = self.records.get(key)
+        if cached and time.monotonic() - cached[0] < self.balance_ttl:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, email))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, key, email):
+        customer = await self.fetch(email)
+        if customer is not None:
+            self.ids[key] = customer.get("id")
+            self.records[key] = (time.monotonic(), customer)
+        return customer
+
+    async def get_id(self, email):
+        customer_id = self.ids.get(email.lower())
+        if customer_id is not None:
+            self.hits += 1
+            return customer_id
+        customer = await self.get(email)
+        return customer.get("id") if customer else None
+
+    def invalidate_balance(self, customer_id):
+        for key, known_id in self.ids.items():
+            if known_id == customer_id:
+                self.records.pop(key, None)
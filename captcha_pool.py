@@ -0,0 +1,103 @@
+# captcha_pool.py (pre-solved reCAPTCHA tokens)
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class CaptchaPool:
+    # Keeps up to `size` solved tokens ready. reCAPTCHA tokens are only valid for
+    # about two minutes, so tokens older than `max_age` are thrown away unused.
+    # Refills stop once nobody has asked for a token in `idle` seconds, so a quiet
+    # bot doesn't keep paying for solves that expire.
+    def __init__(self, solve, size, max_age, idle, retry_delay=5):
+        self.solve = solve
+        self.size = size
+        self.max_age = max_age
+        self.idle = idle
+        self.last_demand = None
+        self.retry_delay = retry_delay
+        self.tokens = deque()
+        self.solving = 0
+        self.fills = set()
+        self.task = None
+        self.wakeup = None
+        self.hits = 0
+        self.misses = 0
+        self.discarded = 0
+
+    def _prune(self):
+        now = time.monotonic()
+        while self.tokens and now - self.tokens[0][0] > self.max_age:
+            self.tokens.popleft()
+            self.discarded += 1
+
+    async def checkout(self):
+        self.last_demand = time.monotonic()
+        self._prune()
+        if self.tokens:
+            self.hits += 1
+            _, token = self.tokens.popleft()
+            self._kick()
+            return token
+        self.misses += 1
+        self._kick()
+        return await self.solve()
+
+    def _kick(self):
+        if self.wakeup:
+            self.wakeup.set()
+
+    def start(self):
+        if self.size > 0 and (self.task is None or self.task.done()):
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        for fill in list(self.fills):
+            fill.cancel()
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _fill_one(self):
+        try:
+            token = await self.solve()
+        except Exception:
+            logger.exception("Pre-solving captcha failed")
+            token = None
+        if token:
+            self.tokens.append((time.monotonic(), token))
+        else:
+            # Don't hammer the solver while it is failing.
+            await asyncio.sleep(self.retry_delay)
+        self.solving -= 1
+        self._kick()
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            self._prune()
+            missing = 0
+            if self.last_demand is not None and time.monotonic() - self.last_demand < self.idle:
+                missing = self.size - len(self.tokens) - self.solving
+            for _ in range(max(0, missing)):
+                self.solving += 1
+                fill = asyncio.create_task(self._fill_one())
+                self.fills.add(fill)
+                fill.add_done_callback(self.fills.discard)
+
+            # Wake up again when the oldest token is about to go stale.
+            timeout = None
+            if self.tokens:
+                timeout = max(0.0, self.max_age - (time.monotonic() - self.tokens[0][0]))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -1,37 +1,189 @@
-# captcha_solver.py (with asyncio task)
+# captcha_solver.py (shared CapSolver client with one polling loop)
 import aiohttp
 import asyncio
+import logging
+import time
+from collections import deque
 from config import *
+from metrics import observe_upstream
+from ratelimit import upstream_limiter
+from circuit import breakers, short_circuited
+from http_client import CircuitOpen
 
-async def solve_captcha():
-    payload = {
-        "clientKey": CAPSOLVER_KEY,
-        "task": {
-            "type": 'ReCaptchaV2TaskProxyLess',
-            "websiteKey": RECAP_SITE_KEY,
-            "websiteURL": RECAP_SITE_URL
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class CaptchaClient:
+    # All outstanding tasks are polled by one loop over one session. The first
+    # poll for a task is timed from how long recent solves took, so most tasks
+    # are ready on the first or second getTaskResult call.
+    def __init__(self, api_url, client_key, deadline, min_interval=1.0, max_interval=5.0, default_interval=3.0):
+        self.api_url = api_url.rstrip("/")
+        self.client_key = client_key
+        self.deadline = deadline
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.default_interval = default_interval
+        self.session = None
+        self.pending = {}
+        self.solve_times = deque(maxlen=200)
+        self.loop_task = None
+        self.polls = set()
+        self.wakeup = None
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+        return self.session
+
+    def first_poll_delay(self):
+        if len(self.solve_times) < 5:
+            return self.default_interval
+        return max(self.min_interval, percentile(self.solve_times, 0.25))
+
+    def poll_interval(self):
+        if len(self.solve_times) < 5:
+            return self.default_interval
+        spread = percentile(self.solve_times, 0.9) - percentile(self.solve_times, 0.25)
+        return min(self.max_interval, max(self.min_interval, spread / 5))
+
+    async def _post(self, method, payload):
+        # Only transport errors count against the breaker; CapSolver's own error
+        # codes (unsolvable, bad key) come back as normal answers.
+        breaker = breakers.get("capsolver", method)
+        if not breaker.allow():
+            short_circuited.inc(upstream="capsolver", endpoint=method)
+            raise CircuitOpen(f"CapSolver {method} not sent: circuit is open", breaker.retry_after())
+        try:
+            async with upstream_limiter.slot("capsolver"):
+                resp = await self._post_now(method, payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            breaker.failure()
+            raise
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        breaker.success()
+        return resp
+
+    async def _post_now(self, method, payload):
+        started = time.perf_counter()
+        try:
+            async with self.get_session().post(f"{self.api_url}/{method}", json=payload) as res:
+                resp = await res.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            observe_upstream("capsolver", method, time.perf_counter() - started, type(e).__name__)
+            raise
+        observe_upstream("capsolver", method, time.perf_counter() - started, resp.get("errorCode") if resp.get("errorId") else None)
+        return resp
+
+    async def solve(self, website_key=RECAP_SITE_KEY, website_url=RECAP_SITE_URL):
+        payload = {
+            "clientKey": self.client_key,
+            "task": {
+                "type": 'ReCaptchaV2TaskProxyLess',
+                "websiteKey": website_key,
+                "websiteURL": website_url
+            }
         }
-    }
+        started = time.monotonic()
+        try:
+            resp = await self._post("createTask", payload)
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpen) as e:
+            logger.error(f"Failed to create captcha task: {e!r}")
+            return None
+        task_id = resp.get("taskId")
+        if not task_id:
+            logger.error(f"Failed to create captcha task: {resp}")
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[task_id] = {"future": future, "started": started, "next_poll": started + self.first_poll_delay()}
+        self._ensure_loop()
+        try:
+            return await asyncio.wait_for(future, max(0, started + self.deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            logger.error(f"Captcha task {task_id} not solved within {self.deadline}s, giving up")
+            return None
+        finally:
+            self.pending.pop(task_id, None)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post("https://api.capsolver.com/createTask", json=payload) as res:
-            resp = await res.json()
-            task_id = resp.get("taskId")
-            if not task_id:
-                print("Failed to create task:", resp)
-                return None
+    def _ensure_loop(self):
+        if self.loop_task is None or self.loop_task.done():
+            self.wakeup = asyncio.Event()
+            self.loop_task = asyncio.create_task(self._poll_loop())
+        else:
+            self.wakeup.set()
 
-            print(f"Got taskId: {task_id} / Getting result...")
+    async def _poll_one(self, task_id, entry):
+        try:
+            resp = await self._post("getTaskResult", {"clientKey": self.client_key, "taskId": task_id})
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpen) as e:
+            logger.warning(f"Polling captcha task {task_id} failed: {e!r}")
+            resp = {}
+        future = entry["future"]
+        if future.done():
+            return
+        status = resp.get("status")
+        if status == "ready":
+            self.solve_times.append(time.monotonic() - entry["started"])
+            future.set_result(resp.get("solution", {}).get('gRecaptchaResponse'))
+        elif status == "failed" or resp.get("errorId"):
+            logger.error(f"Solve failed! response: {resp}")
+            future.set_result(None)
+        else:
+            entry["next_poll"] = time.monotonic() + self.poll_interval()
 
-        # Polling for CAPTCHA result asynchronously
+    async def _poll_loop(self):
+        # Each due task is polled in its own call, so one slow getTaskResult
+        # doesn't hold back the others; a finished poll wakes the loop.
         while True:
-            await asyncio.sleep(3)  # non-blocking delay
-            payload = {"clientKey": CAPSOLVER_KEY, "taskId": task_id}
-            async with session.post("https://api.capsolver.com/getTaskResult", json=payload) as res:
-                resp = await res.json()
-                status = resp.get("status")
-                if status == "ready":
-                    return resp.get("solution", {}).get('gRecaptchaResponse')
-                elif status == "failed" or resp.get("errorId"):
-                    print("Solve failed! response:", resp)
-                    return None
+            self.wakeup.clear()
+            active = [(task_id, entry) for task_id, entry in self.pending.items() if not entry["future"].done()]
+            if not active:
+                return
+            now = time.monotonic()
+            for task_id, entry in active:
+                if entry["next_poll"] <= now:
+                    # Not due again until this poll's answer is in.
+                    entry["next_poll"] = float("inf")
+                    poll = asyncio.create_task(self._poll_one(task_id, entry))
+                    self.polls.add(poll)
+                    poll.add_done_callback(self._polled)
+            next_poll = min(entry["next_poll"] for _, entry in active)
+            timeout = None if next_poll == float("inf") else max(0, next_poll - now)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _polled(self, poll):
+        self.polls.discard(poll)
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def close(self):
+        if self.loop_task:
+            self.loop_task.cancel()
+            try:
+                await self.loop_task
+            except asyncio.CancelledError:
+                pass
+            self.loop_task = None
+        for poll in list(self.polls):
+            poll.cancel()
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+
+captcha_client = CaptchaClient(CAPSOLVER_API_URL, CAPSOLVER_KEY, CAPTCHA_DEADLINE)
+
+
+async def solve_captcha():
+    return await captcha_client.solve()
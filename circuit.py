@@ -0,0 +1,103 @@
+# circuit.py (circuit breakers per upstream endpoint)
+import logging
+import time
+from config import *
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+transitions = registry.counter("bot_circuit_transitions_total", "Circuit breaker state changes.", ("upstream", "endpoint", "state"))
+short_circuited = registry.counter("bot_circuit_rejected_total", "Upstream calls failed fast by an open circuit.", ("upstream", "endpoint"))
+
+
+class CircuitBreaker:
+    # Closed: calls go through and consecutive failures are counted. After
+    # `failures` in a row the circuit opens and calls fail fast for `cooldown`
+    # seconds. Then one probe is let through (half-open): success closes the
+    # circuit, failure opens it for another cooldown.
+    def __init__(self, upstream, endpoint, failures, cooldown):
+        self.upstream = upstream
+        self.endpoint = endpoint
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            transitions.inc(upstream=self.upstream, endpoint=self.endpoint, state=state)
+            log = logger.warning if state == OPEN else logger.info
+            log(f"Circuit for {self.upstream} {self.endpoint} is now {state}")
+
+    def retry_after(self):
+        # Seconds until a call may go through again; 0 when it may go now.
+        if self.state == OPEN:
+            return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+        if self.state == HALF_OPEN and self.probing:
+            return self.cooldown
+        return 0.0
+
+    def allow(self):
+        if self.state == OPEN:
+            if time.monotonic() < self.opened_at + self.cooldown:
+                return False
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def success(self):
+        # Calls sent before the circuit opened may still finish; they don't close it.
+        if self.state == OPEN:
+            return
+        self.failures = 0
+        self.probing = False
+        self._set_state(CLOSED)
+
+    def failure(self):
+        if self.state == OPEN:
+            return
+        self.probing = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def release(self):
+        # The call was cancelled (e.g. it lost a hedge) without an outcome.
+        self.probing = False
+
+
+class Breakers:
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.breakers = {}
+
+    def get(self, upstream, endpoint):
+        breaker = self.breakers.get((upstream, endpoint))
+        if breaker is None:
+            breaker = self.breakers[(upstream, endpoint)] = CircuitBreaker(upstream, endpoint, self.failures, self.cooldown)
+        return breaker
+
+    def retry_after(self, upstream):
+        # Longest wait among the upstream's open endpoints. They usually share one
+        # backend, so a handler needing the upstream is turned away if any is open.
+        return max((breaker.retry_after() for (name, _), breaker in self.breakers.items() if name == upstream), default=0.0)
+
+    def states(self):
+        return {key: STATE_VALUES[breaker.state] for key, breaker in self.breakers.items()}
+
+
+breakers = Breakers(BREAKER_FAILURES, BREAKER_COOLDOWN)
+
+registry.gauge("bot_circuit_state", "Circuit breaker state per endpoint (0 closed, 1 half-open, 2 open).", ("upstream", "endpoint"),
+               callback=breakers.states)
@@ -9,4 +9,100 @@ PRODUCT_ID = os.getenv("PRODUCT_ID")
 API_KEY = os.getenv("SHOP_API_KEY")
 CAPSOLVER_KEY = os.getenv("CAPSOLVER_KEY")
 RECAP_SITE_KEY = os.getenv("RECAP_SITE_KEY")
-RECAP_SITE_URL = os.getenv("RECAP_SITE_URL")
\ No newline at end of file
+RECAP_SITE_URL = os.getenv("RECAP_SITE_URL")
+SELLPASS_API_URL = os.getenv("SELLPASS_API_URL", "https://dev.sellpass.io")
+SELLPASS_STORE_API_URL = os.getenv("SELLPASS_STORE_API_URL", "https://api.sellpass.io")
+HOODPAY_API_URL = os.getenv("HOODPAY_API_URL", "https://api.hoodpay.io")
+CAPSOLVER_API_URL = os.getenv("CAPSOLVER_API_URL", "https://api.capsolver.com")
+CAPTCHA_DEADLINE = float(os.getenv("CAPTCHA_DEADLINE", "120"))
+
+STORE_BACKEND = os.getenv("STORE_BACKEND", "sqlite")
+STORE_PATH = os.getenv("STORE_PATH", "store.db")
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "5"))
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", "20"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 0 disables the Prometheus endpoint.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", "8"))
+JOURNAL_COMPACT_INTERVAL = float(os.getenv("JOURNAL_COMPACT_INTERVAL", "600"))
+JOURNAL_COMPACT_THRESHOLD = int(os.getenv("JOURNAL_COMPACT_THRESHOLD", "1000"))
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "20"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))
+
+# command=burst/seconds per Telegram user, and upstream=max concurrent calls. Empty disables.
+RATE_LIMITS = os.getenv("RATE_LIMITS", "preorder=5/30,login=3/60,otp=5/60,crypto=3/30,coin=5/30,balance=3/30")
+UPSTREAM_CONCURRENCY = os.getenv("UPSTREAM_CONCURRENCY", "sellpass=20,hoodpay=20,capsolver=20")
+UPSTREAM_BUSY_RETRY = float(os.getenv("UPSTREAM_BUSY_RETRY", "3"))
+# Whole-request time limits per upstream (retries included), circuit breakers and hedged GETs.
+UPSTREAM_BUDGETS = os.getenv("UPSTREAM_BUDGETS", "sellpass=10,hoodpay=10")
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+HTTP_HEDGE_DELAY = float(os.getenv("HTTP_HEDGE_DELAY", "1"))
+
+# After this an open invoice is only checked every POLL_MAX_INTERVAL; after the
+# give-up time it is marked expired locally.
+INVOICE_EXPIRY_MINUTES = float(os.getenv("INVOICE_EXPIRY_MINUTES", "120"))
+INVOICE_GIVE_UP_HOURS = float(os.getenv("INVOICE_GIVE_UP_HOURS", "48"))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "10"))
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "10"))
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "120"))
+POLL_BACKOFF = float(os.getenv("POLL_BACKOFF", "0.1"))
+POLL_FALLBACK_INTERVAL = float(os.getenv("POLL_FALLBACK_INTERVAL", "300"))
+
+HOODPAY_WEBHOOK_SECRET = os.getenv("HOODPAY_WEBHOOK_SECRET")
+HOODPAY_WEBHOOK_HOST = os.getenv("HOODPAY_WEBHOOK_HOST", "0.0.0.0")
+HOODPAY_WEBHOOK_PORT = int(os.getenv("HOODPAY_WEBHOOK_PORT", "8081"))
+HOODPAY_WEBHOOK_PATH = os.getenv("HOODPAY_WEBHOOK_PATH", "/hoodpay/webhook")
+HOODPAY_WEBHOOK_SIGNATURE_HEADER = os.getenv("HOODPAY_WEBHOOK_SIGNATURE_HEADER", "X-Hoodpay-Signature")
+
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+TELEGRAM_MODE = os.getenv("TELEGRAM_MODE", "polling")
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+TELEGRAM_WEBHOOK_LISTEN = os.getenv("TELEGRAM_WEBHOOK_LISTEN", "0.0.0.0")
+TELEGRAM_WEBHOOK_PORT = int(os.getenv("TELEGRAM_WEBHOOK_PORT", "8443"))
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "telegram")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+VARIANT_CACHE_TTL = float(os.getenv("VARIANT_CACHE_TTL", "30"))
+VARIANT_CACHE_STALE = float(os.getenv("VARIANT_CACHE_STALE", "300"))
+
+SESSION_FILE = os.getenv("SESSION_FILE", "buffcreditbot/user_data.txt")
+SESSION_REAP_INTERVAL = float(os.getenv("SESSION_REAP_INTERVAL", "300"))
+SESSION_COMPACT_THRESHOLD = int(os.getenv("SESSION_COMPACT_THRESHOLD", "100"))
+USER_STATE_PATH = os.getenv("USER_STATE_PATH", "user_state.db")
+USER_STATE_FLUSH_INTERVAL = float(os.getenv("USER_STATE_FLUSH_INTERVAL", "1"))
+USER_STATE_MAX_AGE = float(os.getenv("USER_STATE_MAX_AGE", "86400"))
+
+# 0 leaves allocation to the /deliver admin command.
+DELIVERY_INTERVAL = float(os.getenv("DELIVERY_INTERVAL", "0"))
+DELIVERY_LEDGER_FILE = os.getenv("DELIVERY_LEDGER_FILE", "delivery_ledger.json")
+QUEUE_PAGE_SIZE = int(os.getenv("QUEUE_PAGE_SIZE", "20"))
+
+# Telegram allows ~30 messages/s overall and ~1/s per chat; stay a little under.
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", "1"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+# Message waiting users their new queue position after each allocation (costs Bot API budget).
+NOTIFY_QUEUE_UPDATES = os.getenv("NOTIFY_QUEUE_UPDATES", "0") == "1"
+
+# Every pre-solved token is a paid solve; 0 turns the pool off. The pool only
+# refills within CAPTCHA_POOL_IDLE seconds of the last login asking for a token.
+CAPTCHA_POOL_SIZE = int(os.getenv("CAPTCHA_POOL_SIZE", "0"))
+CAPTCHA_POOL_IDLE = float(os.getenv("CAPTCHA_POOL_IDLE", "600"))
+CAPTCHA_TOKEN_MAX_AGE = float(os.getenv("CAPTCHA_TOKEN_MAX_AGE", "90"))
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", "15"))
+
+ORDER_WAL_FILE = os.getenv("ORDER_WAL_FILE", "order_wal.ndjson")
+# How often orders whose charge was refused by an open circuit are tried again.
+ORDER_RETRY_INTERVAL = float(os.getenv("ORDER_RETRY_INTERVAL", "30"))
@@ -0,0 +1,98 @@
+# delivery.py (reserves in-stock units for waiting preorders)
+import asyncio
+import json
+import logging
+import os
+from executor import run_blocking
+
+logger = logging.getLogger(__name__)
+
+
+class StockLedger:
+    # Units we have allocated still show up in the shop's stock until they are
+    # taken off there, so each variant keeps a count of units allocated but not
+    # yet gone from the reported stock. When the stock drops, that count shrinks
+    # by the same amount. Saved to disk so a restart can't hand out a unit twice.
+    def __init__(self, path):
+        self.path = path
+        self.variants = {}
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self.variants = json.load(f)
+        except FileNotFoundError:
+            self.variants = {}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.variants, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def available(self, variant_id, stock):
+        entry = self.variants.setdefault(variant_id, {"stock": stock, "reserved": 0})
+        if stock < entry["stock"]:
+            entry["reserved"] = max(0, entry["reserved"] - (entry["stock"] - stock))
+        entry["stock"] = stock
+        return max(0, stock - entry["reserved"])
+
+    def reserve(self, variant_id, quantity):
+        self.variants[variant_id]["reserved"] += quantity
+
+
+class DeliveryEngine:
+    # Allocates stock to the queue; the units themselves are sent by an admin from
+    # the list run() returns. fetch_variants() returns fresh variants with their
+    # stock, mark_delivered(invoice_ids) takes orders off the queue in the store in
+    # one go, notify(order) queues a message to the buyer.
+    def __init__(self, queue, ledger, fetch_variants, mark_delivered, notify):
+        self.queue = queue
+        self.ledger = ledger
+        self.fetch_variants = fetch_variants
+        self.mark_delivered = mark_delivered
+        self.notify = notify
+        self.lock = asyncio.Lock()
+        self.delivered = 0
+
+    def allocate(self, variants):
+        # Strict FIFO per variant: an order that doesn't fit stops the line, so a
+        # large early order isn't overtaken by smaller later ones.
+        allocations = []
+        for variant in variants:
+            variant_id = str(variant['id'])
+            available = self.ledger.available(variant_id, int(variant['stock'] or 0))
+            for order in self.queue.pending(variant_id):
+                if order['quantity'] > available:
+                    break
+                available -= order['quantity']
+                allocations.append(order)
+        return allocations
+
+    async def run(self):
+        async with self.lock:
+            variants = await self.fetch_variants()
+            if not variants:
+                return []
+            allocations = self.allocate(variants)
+            if not allocations:
+                await run_blocking("delivery", self.ledger.save)
+                return []
+
+            # Reserve first: after a crash we'd rather hold units back than hand them out twice.
+            for order in allocations:
+                self.ledger.reserve(str(order['variant_id']), order['quantity'])
+            await run_blocking("delivery", self.ledger.save)
+            await self.mark_delivered([order['invoice_id'] for order in allocations])
+            for order in allocations:
+                self.queue.mark_delivered(order['invoice_id'])
+            self.delivered += len(allocations)
+            logger.info(f"Allocated {len(allocations)} orders "
+                        f"({sum(order['quantity'] for order in allocations)} units across "
+                        f"{len({order['variant_id'] for order in allocations})} variants)")
+
+            for order in allocations:
+                self.notify(order)
+        return allocations
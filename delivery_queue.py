@@ -0,0 +1,113 @@
+# delivery_queue.py (undelivered orders in FIFO order with O(log n) positions)
+from collections import deque
+
+
+class FenwickTree:
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def add(self, index, delta):
+        index += 1
+        while index <= self.size:
+            self.tree[index] += delta
+            index += index & -index
+
+    def prefix(self, index):
+        # Sum of positions 0..index inclusive.
+        index += 1
+        total = 0
+        while index > 0:
+            total += self.tree[index]
+            index -= index & -index
+        return total
+
+
+class DeliveryQueue:
+    # Every order gets a slot in arrival order. The tree holds 1 for each slot that
+    # is still waiting, so a user's position is the prefix sum up to their first slot.
+    def __init__(self, capacity=1024):
+        self.orders = []
+        self.tree = FenwickTree(capacity)
+        self.slots = {}
+        self.user_slots = {}
+        self.variant_slots = {}
+        self.variants = {}
+
+    def load(self, orders):
+        self.clear()
+        for order in orders:
+            self.append(order)
+
+    def clear(self):
+        self.orders = []
+        self.tree = FenwickTree(self.tree.size)
+        self.slots = {}
+        self.user_slots = {}
+        self.variant_slots = {}
+        self.variants = {}
+
+    def _grow(self):
+        self.tree = FenwickTree(self.tree.size * 2)
+        for slot, order in enumerate(self.orders):
+            if order is not None:
+                self.tree.add(slot, 1)
+
+    def append(self, order):
+        if order['invoice_id'] in self.slots:
+            return
+        slot = len(self.orders)
+        if slot >= self.tree.size:
+            self._grow()
+        self.orders.append(order)
+        self.tree.add(slot, 1)
+        self.slots[order['invoice_id']] = slot
+        self.user_slots.setdefault(order['user_id'], deque()).append(slot)
+        self.variant_slots.setdefault(order['variant_id'], deque()).append(slot)
+        summary = self.variants.setdefault(order['variant_id'], {'title': order['variant_title'], 'orders': 0, 'quantity': 0})
+        summary['orders'] += 1
+        summary['quantity'] += order['quantity']
+
+    def mark_delivered(self, invoice_id):
+        slot = self.slots.pop(invoice_id, None)
+        if slot is None:
+            return None
+        order = self.orders[slot]
+        self.orders[slot] = None
+        self.tree.add(slot, -1)
+        summary = self.variants[order['variant_id']]
+        summary['orders'] -= 1
+        summary['quantity'] -= order['quantity']
+        if summary['orders'] == 0:
+            del self.variants[order['variant_id']]
+        # The user's and variant's slot lists are cleaned up lazily in position() / pending().
+        return order
+
+    def position(self, user_id):
+        slots = self.user_slots.get(user_id)
+        while slots and self.orders[slots[0]] is None:
+            slots.popleft()
+        if not slots:
+            self.user_slots.pop(user_id, None)
+            return None
+        return self.tree.prefix(slots[0])
+
+    def pending(self, variant_id):
+        # Undelivered orders for one variant, oldest first.
+        slots = self.variant_slots.get(variant_id)
+        while slots and self.orders[slots[0]] is None:
+            slots.popleft()
+        if not slots:
+            self.variant_slots.pop(variant_id, None)
+            return []
+        return [self.orders[slot] for slot in slots if self.orders[slot] is not None]
+
+    def summary(self):
+        # Per-variant order counts and unit totals, maintained on append / delivery.
+        return dict(self.variants)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __iter__(self):
+        return (order for order in self.orders if order is not None)
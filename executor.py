@@ -0,0 +1,107 @@
+# executor.py (bounded thread pool for blocking file and database work)
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class BlockingExecutor:
+    # Blocking calls are grouped into lanes, one per file or database they touch.
+    # Each lane has its own semaphore, so calls that would only queue up on the
+    # same lock wait here without holding a worker, and one slow lane can't take
+    # the whole pool.
+    def __init__(self, max_workers, lanes, default_limit=1):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking")
+        self.limits = dict(lanes)
+        self.default_limit = default_limit
+        self.semaphores = {}
+        self.lock = threading.Lock()
+        self.queued = {}
+        self.running = {}
+        self.calls = {}
+        self.wait_times = {}
+
+    def _semaphore(self, lane):
+        if lane not in self.semaphores:
+            self.semaphores[lane] = asyncio.Semaphore(self.limits.get(lane, self.default_limit))
+            self.queued[lane] = 0
+            self.running[lane] = 0
+            self.calls[lane] = 0
+            self.wait_times[lane] = deque(maxlen=500)
+        return self.semaphores[lane]
+
+    def _call(self, lane, submitted, state, func):
+        # Runs on a worker thread; the wait covers both the lane semaphore and the pool queue.
+        with self.lock:
+            if state['cancelled']:
+                return None
+            state['started'] = True
+            self.queued[lane] -= 1
+            self.running[lane] += 1
+            self.wait_times[lane].append(time.perf_counter() - submitted)
+        try:
+            return func()
+        finally:
+            with self.lock:
+                self.running[lane] -= 1
+                self.calls[lane] += 1
+
+    async def run(self, lane, func, *args, **kwargs):
+        semaphore = self._semaphore(lane)
+        submitted = time.perf_counter()
+        state = {'started': False, 'cancelled': False}
+        with self.lock:
+            self.queued[lane] += 1
+        try:
+            async with semaphore:
+                loop = asyncio.get_running_loop()
+                # Copy the context so log records from the worker keep their correlation ids.
+                call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+                return await loop.run_in_executor(self.pool, self._call, lane, submitted, state, call)
+        except asyncio.CancelledError:
+            # A call no worker has picked up yet is dropped; one already running finishes.
+            with self.lock:
+                if not state['started']:
+                    state['cancelled'] = True
+                    self.queued[lane] -= 1
+            raise
+
+    def stats(self):
+        with self.lock:
+            lanes = {}
+            for lane in self.semaphores:
+                waits = list(self.wait_times[lane])
+                lanes[lane] = {
+                    'limit': self.limits.get(lane, self.default_limit),
+                    'queued': self.queued[lane],
+                    'running': self.running[lane],
+                    'calls': self.calls[lane],
+                    'wait_p50': percentile(waits, 0.5) if waits else 0.0,
+                    'wait_p99': percentile(waits, 0.99) if waits else 0.0,
+                    'wait_max': max(waits) if waits else 0.0,
+                }
+            return lanes
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+# The order store and the session file each take one writer at a time anyway.
+executor = BlockingExecutor(EXECUTOR_WORKERS, {"store": 1, "sessions": 1, "orders": 1})
+
+
+async def run_blocking(lane, func, *args, **kwargs):
+    return await executor.run(lane, func, *args, **kwargs)
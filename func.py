@@ -1,13 +1,34 @@
 from config import *
-from main import logger, processing_queue
+from main import logger
 from datetime import datetime, timezone
-import requests
+import http_client
 import json
 import string
 import random
 import asyncio
+import time
+import os
 from telegram.constants import ParseMode
 from main import ORDER_FILE, INVOICE_FILE
+from storage import open_store, journal_path
+from sessions import SessionStore
+from delivery_queue import DeliveryQueue
+from poller import InvoicePoller
+from cache import VariantCache, CustomerCache
+from webhook import HoodpayWebhook
+from order_pipeline import OrderLog, OrderPipeline, NOT_SENT
+from delivery import StockLedger, DeliveryEngine
+from notifier import Notifier, PAYMENT, DELIVERY, QUEUE_UPDATE, MAX_TEXT_LENGTH
+from executor import executor, run_blocking
+from metrics import registry
+from log_setup import log_context
+
+store = open_store(STORE_BACKEND, STORE_PATH, ORDER_FILE, INVOICE_FILE)
+session_store = SessionStore(SESSION_FILE)
+session_store.load()
+processing_queue = DeliveryQueue()
+processing_queue.load(store.undelivered_orders())
+notifier = Notifier(NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_INTERVAL, NOTIFY_MAX_RETRIES)
 
 async def handle_crypto_payment(query, context, payment_method):
     if context.user_data is None or 'hoodpay_id' not in context.user_data:
@@ -24,10 +45,10 @@ async def handle_crypto_payment(query, context, payment_method):
     user_id = query.from_user.id
     valid_accounts = load_user_data(user_id)
     sellpass_email = valid_accounts[0]['email']
-    sellpass_customerid = get_customer_id_by_email(sellpass_email)
+    sellpass_customerid = await get_customer_id_by_email(sellpass_email)
     total_price = quantity * price
 
-    status, payment_name, payment_amount, payment_address = select_payment_method(hoodpay_id, payment_method)
+    status, payment_name, payment_amount, payment_address = await select_payment_method(hoodpay_id, payment_method)
 
     invoice_data = {
         "email": sellpass_email,
@@ -48,7 +69,7 @@ async def handle_crypto_payment(query, context, payment_method):
     }
 
     if status == 200:
-        save_crypto_invoice(invoice_data)
+        await save_crypto_invoice(invoice_data)
         payment_message = f"""
 <strong>Payment Details for Your Order</strong>
 
@@ -69,123 +90,150 @@ async def handle_crypto_payment(query, context, payment_method):
         await query.edit_message_text(
             text=payment_message, parse_mode=ParseMode.HTML, disable_web_page_preview=True
         )
-        asyncio.create_task(check_invoice_status(context, invoice_id, hoodpay_id))
+        invoice_poller.add(invoice_id, hoodpay_id)
     else:
         logger.error(f"Failed to select payment method: {status} {payment_name}")
         await query.edit_message_text(text=f"Failed to select payment method for {invoice_id}. Please try again or contact support.")
 
 
-async def check_invoice_status(context, invoice_id, hoodpay_id):
-    logger.info(f"Starting status check for Invoice ID: {invoice_id}")
-    while True:
-        try:
-            response = requests.get(f"https://api.hoodpay.io/v1/public/payments/hosted-page/{hoodpay_id}")
-            if response.status_code == 200:
-                response_data = response.json()
-                status_data = response_data.get('data', {})
-                
-                status = status_data.get("status")
-                
-                if status == "COMPLETED":
-                    logger.info(f"Invoice {invoice_id} COMPLETED. Processing order.")
-                    update_invoice_status(invoice_id, "COMPLETED")
-                    await process_order(context, invoice_id)
-                    return
-                elif status in ["EXPIRED", "CANCELLED"]:
-                    logger.warning(f"Invoice {invoice_id} marked as {status}. Aborting order.")
-                    update_invoice_status(invoice_id, status)
-                    return
-                else:
-                    logger.info(f"Invoice {invoice_id} status: {status}. Rechecking in 1 minute.")
-            else:
-                logger.error(f"Failed to check status for {invoice_id}. HTTP Status: {response.status_code}")
-        except requests.RequestException as e:
-            logger.error(f"Error checking invoice status: {e}")
-
-        await asyncio.sleep(60)
+async def check_invoice_status(invoice_id, hoodpay_id):
+    try:
+        response = await http_client.get(f"{HOODPAY_API_URL}/v1/public/payments/hosted-page/{hoodpay_id}", upstream="hoodpay", endpoint="payment_status", hedge=HTTP_HEDGE_DELAY)
+        if response.status_code == 200:
+            response_data = response.json()
+            status_data = response_data.get('data', {})
 
-async def monitor_pending_invoices(context):
-    if not os.path.exists(INVOICE_FILE):
-        return
+            status = status_data.get("status")
 
-    with open(INVOICE_FILE, 'r') as f:
-        invoices = json.load(f)
-
-    for invoice in invoices:
-        if invoice['status'] == "AWAITING_PAYMENT":
-            logger.info(f"Resuming status check for pending invoice {invoice['invoice_id']}")
-            asyncio.create_task(check_invoice_status(context, invoice['invoice_id'], invoice['hoodpay_id']))
-
-async def process_order(context, invoice_id):
-    with open(INVOICE_FILE, 'r') as f:
-        invoices = json.load(f)
-
-    for invoice in invoices:
-        if invoice['invoice_id'] == invoice_id and invoice['status'] == "COMPLETED":
-            customer_id = invoice['customer_id']
-            total_price = invoice['total_price']
-
-            success, message = remove_balance_to_user(customer_id, total_price)
-            if success:
-                logger.info(f"Balance successfully deducted for Invoice ID: {invoice_id}")
-
-                order_details = {
-                    'user_id': invoice['user_id'],
-                    'username': invoice['username'],
-                    'variant_id': invoice['variant_id'],
-                    'variant_title': invoice['variant_title'],
-                    'quantity': invoice['amount'],
-                    'payment_method': invoice['payment_method'],
-                    'timestamp': invoice['timestamp'],
-                    'invoice_id': invoice['invoice_id'],
-                    'delivered': False
-                }
-                save_order_to_file(order_details)
-                processing_queue.append(order_details)
-                logger.info(f"Order processed successfully for Invoice ID: {invoice_id}")
+            if status in ["COMPLETED", "EXPIRED", "CANCELLED"]:
+                await apply_invoice_status(invoice_id, status)
+                return True
             else:
-                logger.error(f"Failed to remove balance for Invoice ID: {invoice_id}. Message: {message}")
-            break
-
-def save_crypto_invoice(invoice_data):
-    if not os.path.exists(INVOICE_FILE):
-        with open(INVOICE_FILE, 'w') as f:
-            json.dump([], f)
-    with open(INVOICE_FILE, 'r') as f:
-        existing_invoices = json.load(f)
-
-    existing_invoices.append(invoice_data)
+                logger.info(f"Invoice {invoice_id} status: {status}.", extra={"sample": "invoice_status"})
+        else:
+            logger.error(f"Failed to check status for {invoice_id}. HTTP Status: {response.status_code}")
+    except http_client.RequestError as e:
+        logger.error(f"Error checking invoice status: {e}")
+    return False
+
+async def apply_invoice_status(invoice_id, status):
+    # Shared by the poller and the Hoodpay webhook; only the first report of a
+    # final status for an AWAITING_PAYMENT invoice acts on it. The status change
+    # is a compare-and-set, so of two concurrent reports exactly one wins.
+    with log_context(invoice_id=invoice_id):
+        invoice = await run_blocking("store", store.get_invoice, invoice_id)
+        if invoice is None or invoice['status'] != "AWAITING_PAYMENT":
+            return
+        if not await update_invoice_status(invoice_id, status, expected="AWAITING_PAYMENT"):
+            return
+        invoice_poller.discard(invoice_id)
+        if status == "COMPLETED":
+            logger.info(f"Invoice {invoice_id} COMPLETED. Processing order.")
+            await process_order(invoice_id)
+        else:
+            logger.warning(f"Invoice {invoice_id} marked as {status}. Aborting order.")
+            notifier.send(invoice['user_id'], f"Your payment for invoice {invoice_id} was {status.lower()}. No order was placed; use /preorder to start again.", priority=PAYMENT)
+
+async def handle_hoodpay_event(hoodpay_id, status):
+    with log_context(hoodpay_id=hoodpay_id):
+        invoice = await run_blocking("store", store.get_invoice_by_hoodpay_id, hoodpay_id)
+        if invoice is None:
+            logger.warning(f"Hoodpay webhook for unknown payment {hoodpay_id}")
+            return
+        await apply_invoice_status(invoice['invoice_id'], status)
+
+async def expire_invoice(invoice_id):
+    # Hoodpay never reported a final status; stop waiting for it.
+    await apply_invoice_status(invoice_id, "EXPIRED")
+
+# With the webhook enabled the poller is only a safety net and runs at a slow, fixed pace.
+if HOODPAY_WEBHOOK_SECRET:
+    poll_min_interval, poll_max_interval = POLL_FALLBACK_INTERVAL, POLL_FALLBACK_INTERVAL
+else:
+    poll_min_interval, poll_max_interval = POLL_MIN_INTERVAL, POLL_MAX_INTERVAL
+
+invoice_poller = InvoicePoller(
+    check_invoice_status, expire_invoice,
+    concurrency=POLL_CONCURRENCY,
+    expiry=INVOICE_EXPIRY_MINUTES * 60,
+    give_up=INVOICE_GIVE_UP_HOURS * 3600,
+    min_interval=poll_min_interval,
+    max_interval=poll_max_interval,
+    backoff=POLL_BACKOFF
+)
+
+hoodpay_webhook = HoodpayWebhook(HOODPAY_WEBHOOK_SECRET, handle_hoodpay_event)
+
+def invoice_created_at(invoice):
+    return datetime.fromisoformat(invoice['timestamp']).replace(tzinfo=timezone.utc).timestamp()
 
-    with open(INVOICE_FILE, 'w') as f:
-        json.dump(existing_invoices, f, indent=4)
-    logger.info(f"Saved new invoice to {INVOICE_FILE} with ID: {invoice_data['invoice_id']}")
+async def monitor_pending_invoices(context):
+    await order_pipeline.recover()
+    for invoice in await run_blocking("store", store.invoices_by_status, "AWAITING_PAYMENT"):
+        logger.info(f"Resuming status check for pending invoice {invoice['invoice_id']}")
+        invoice_poller.add(invoice['invoice_id'], invoice['hoodpay_id'], invoice_created_at(invoice))
+
+async def process_order(invoice_id):
+    invoice = await run_blocking("store", store.get_invoice, invoice_id)
+    if invoice and invoice['status'] == "COMPLETED":
+        order_details = {
+            'user_id': invoice['user_id'],
+            'username': invoice['username'],
+            'variant_id': invoice['variant_id'],
+            'variant_title': invoice['variant_title'],
+            'quantity': invoice['amount'],
+            'payment_method': invoice['payment_method'],
+            'timestamp': invoice['timestamp'],
+            'invoice_id': invoice['invoice_id'],
+            'delivered': False
+        }
+        success, message = await order_pipeline.run(invoice_id, order_details, invoice['customer_id'], invoice['total_price'])
+        if success:
+            logger.info(f"Order processed successfully for Invoice ID: {invoice_id}")
+            notifier.send(
+                invoice['user_id'],
+                f"Payment received! Your preorder for x{invoice['amount']} {invoice['variant_title']} is confirmed.\n"
+                f"Invoice ID: {invoice_id}",
+                priority=PAYMENT
+            )
+        elif order_pipeline.retrying(invoice_id):
+            logger.warning(f"Order for Invoice ID: {invoice_id} will be retried. Message: {message}")
+            notifier.send(invoice['user_id'], f"We received your payment for invoice {invoice_id}. The shop is not responding right now; your order will be placed as soon as it is back.", priority=PAYMENT)
+        else:
+            logger.error(f"Failed to process order for Invoice ID: {invoice_id}. Message: {message}")
+            notifier.send(invoice['user_id'], f"We received your payment for invoice {invoice_id} but could not place the order. Please contact support.", priority=PAYMENT)
 
-def update_invoice_status(invoice_id, new_status):
-    if not os.path.exists(INVOICE_FILE):
-        return
+def notify_recovered_order(order, ok, message):
+    if ok:
+        text = f"Your preorder for x{order['quantity']} {order['variant_title']} is confirmed.\nInvoice ID: {order['invoice_id']}"
+    else:
+        text = f"We could not place your order for invoice {order['invoice_id']}: {message}. Please contact support."
+    notifier.send(order['user_id'], text, priority=PAYMENT)
 
-    with open(INVOICE_FILE, 'r') as f:
-        invoices = json.load(f)
+async def retry_orders(context):
+    await order_pipeline.recover()
 
-    for invoice in invoices:
-        if invoice['invoice_id'] == invoice_id:
-            invoice['status'] = new_status
+async def save_crypto_invoice(invoice_data):
+    await run_blocking("store", store.add_invoice, invoice_data)
+    logger.info(f"Saved new invoice with ID: {invoice_data['invoice_id']}")
 
-    with open(INVOICE_FILE, 'w') as f:
-        json.dump(invoices, f, indent=4)
-    logger.info(f"Updated status of invoice {invoice_id} to {new_status}")
+async def update_invoice_status(invoice_id, new_status, expected=None):
+    if await run_blocking("store", store.set_invoice_status, invoice_id, new_status, expected):
+        logger.info(f"Updated status of invoice {invoice_id} to {new_status}")
+        return True
+    return False
 
-def get_variants():
-    get_url = f"https://dev.sellpass.io/self/{SHOP_ID}/v2/products/{PRODUCT_ID}"
+async def get_variants():
+    get_url = f"{SELLPASS_API_URL}/self/{SHOP_ID}/v2/products/{PRODUCT_ID}"
     headers = {
         "Authorization": f"Bearer {API_KEY}",
         "Content-Type": "application/json"
     }
     try:
-        response = requests.get(get_url, headers=headers)
+        response = await http_client.get(get_url, headers=headers, upstream="sellpass", endpoint="get_product")
         response.raise_for_status()
         product_data = response.json()['data']
-    except requests.RequestException as e:
+    except http_client.RequestError as e:
         print(f"Failed to fetch product {PRODUCT_ID}. Error: {e}")
         return []
 
@@ -214,33 +262,19 @@ def get_variants():
     
     return variant_details
 
-def get_customer_id_by_email(email):
-    url = f"https://dev.sellpass.io/self/{SHOP_ID}/customers?email={email}"
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            customers = data.get('data', [])
-            for customer in customers:
-                if customer['customer']['email'] == email:
-                    return customer.get("id")
-        return None
-    except requests.RequestException as e:
-        logger.error(f"Error fetching customer ID: {e}")
-        return None
+variant_cache = VariantCache(get_variants, ttl=VARIANT_CACHE_TTL, stale_ttl=VARIANT_CACHE_STALE)
 
-def get_invoice(invoice_id):
-    url = f"https://dev.sellpass.io/self/{SHOP_ID}/invoices/{invoice_id}"
+async def get_customer_id_by_email(email):
+    return await customer_cache.get_id(email)
+
+async def get_invoice(invoice_id):
+    url = f"{SELLPASS_API_URL}/self/{SHOP_ID}/invoices/{invoice_id}"
     headers = {
         'Authorization': f'Bearer {API_KEY}',
         'Content-Type': 'application/json'
     }
     try:
-        response = requests.get(url, headers=headers)
+        response = await http_client.get(url, headers=headers, upstream="sellpass", endpoint="get_invoice", hedge=HTTP_HEDGE_DELAY)
         if response.status_code == 200:
             data = response.json()
             invoice_data = data.get('data', {})
@@ -253,11 +287,11 @@ def get_invoice(invoice_id):
         else:
             logger.error(f"Failed to fetch invoice: {response.status_code} {response.text}")
             return None, None
-    except requests.RequestException as e:
+    except http_client.RequestError as e:
         logger.error(f"Error fetching invoice data: {e}")
         return None, None
 
-def save_user_data(email, user_id, token, expiry, expiry_raw):
+async def save_user_data(email, user_id, token, expiry, expiry_raw):
     user_info = {
         "email": email,
         "user_id": user_id,
@@ -265,40 +299,36 @@ def save_user_data(email, user_id, token, expiry, expiry_raw):
         "expiry": expiry.strftime("%Y-%m-%d %H:%M:%S"),
         "expiry_raw": expiry_raw
     }
-    with open("buffcreditbot/user_data.txt", "a") as file:
-        file.write(json.dumps(user_info) + "\n")
-
-def remove_expired_tokens():
-    try:
-        while True:
-            with open("buffcreditbot/user_data.txt", "r") as file:
-                user_data = [json.loads(line) for line in file.readlines()]
-            with open("buffcreditbot/user_data.txt", "w") as file:
-                for data in user_data:
-                    expiry_time = datetime.fromtimestamp(data["expiry_raw"], tz=timezone.utc)
-                    if expiry_time > datetime.now(timezone.utc):
-                        file.write(json.dumps(data) + "\n")
-    except FileNotFoundError:
-        pass
+    await run_blocking("sessions", session_store.add, user_info)
+
+async def reap_expired_sessions(context):
+    started = time.perf_counter()
+    removed = session_store.evict_expired()
+    dead = session_store.dead()
+    compacted = dead >= SESSION_COMPACT_THRESHOLD
+    if compacted:
+        await run_blocking("sessions", session_store.compact)
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info(f"Session reaper removed {removed} expired sessions in {elapsed:.1f} ms"
+                + (f", compacted {dead} dead entries" if compacted else ""))
+
+async def compact_store(context):
+    dead = store.dead()
+    if dead < JOURNAL_COMPACT_THRESHOLD:
+        return
+    started = time.perf_counter()
+    await run_blocking("store", store.compact)
+    elapsed = (time.perf_counter() - started) * 1000
+    logger.info(f"Compacted {dead} superseded journal entries in {elapsed:.1f} ms")
 
 def load_user_data(user_id):
-    valid_accounts = []
-    try:
-        with open("buffcreditbot/user_data.txt", "r") as file:
-            user_data = [json.loads(line) for line in file.readlines()]
-            for data in user_data:
-                if data["user_id"] == user_id:
-                    expiry_time = datetime.fromtimestamp(data["expiry_raw"], tz=timezone.utc)
-                    if expiry_time > datetime.now(timezone.utc):
-                        valid_accounts.append(data)
-                    else:
-                        print(f"Token expired for {data['email']}, removing.")
-    except FileNotFoundError:
-        pass
-    return valid_accounts
-  
-def select_payment_method(invoice_id, payment_method):
-    url = f'https://api.hoodpay.io/v1/public/payments/hosted-page/{invoice_id}/select-payment-method'
+    return session_store.get(user_id)
+
+async def remove_user_data(user_id):
+    return await run_blocking("sessions", session_store.remove_user, user_id)
+
+async def select_payment_method(invoice_id, payment_method):
+    url = f'{HOODPAY_API_URL}/v1/public/payments/hosted-page/{invoice_id}/select-payment-method'
     
     headers = {
         'Content-Type': 'application/json'
@@ -316,7 +346,7 @@ def select_payment_method(invoice_id, payment_method):
         }
 
     try:
-        response = requests.post(url, json=post_data, headers=headers)
+        response = await http_client.post(url, json=post_data, headers=headers, upstream="hoodpay", endpoint="select_payment_method")
         if response.status_code == 200:
             data = response.json()
             invoice_data = data.get('data', {})
@@ -329,7 +359,7 @@ def select_payment_method(invoice_id, payment_method):
         else:
             logger.error(f"Failed to parse payment method: {response.status_code} {response.text}")
             return None, None, None, None
-    except requests.RequestException as e:
+    except http_client.RequestError as e:
         logger.error(f"Error parsing payment method: {e}")
         return None, None, None, None
 
@@ -338,114 +368,134 @@ def generate_invoice_id():
     random_string = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
     return f"BuffPal-{timestamp}-{random_string}"
 
-def save_order_to_file(order_details):
-    if not os.path.exists(ORDER_FILE):
-        with open(ORDER_FILE, 'w') as f:
-            json.dump([], f)
-    with open(ORDER_FILE, 'r') as f:
-        existing_orders = json.load(f)
-
-    existing_orders.append(order_details)
-
-    with open(ORDER_FILE, 'w') as f:
-        json.dump(existing_orders, f, indent=4)
+async def save_order_to_file(order_details):
+    await run_blocking("store", store.add_order, order_details)
     logger.info(f"Order saved successfully for Invoice ID: {order_details['invoice_id']}")
 
-def get_customer_data_by_email(email):
-    url = f"https://dev.sellpass.io/self/{SHOP_ID}/customers?email={email.lower()}"
+async def fetch_customer_by_email(email):
+    url = f"{SELLPASS_API_URL}/self/{SHOP_ID}/customers?email={email.lower()}"
     headers = {
         'Authorization': f'Bearer {API_KEY}',
         'Content-Type': 'application/json'
     }
     try:
-        response = requests.get(url, headers=headers)
+        response = await http_client.get(url, headers=headers, upstream="sellpass", endpoint="get_customer")
         if response.status_code == 200:
             data = response.json()
             customers = data.get('data', [])
             for customer in customers:
-                if customer['customer']['email'] == email:
+                if customer['customer']['email'].lower() == email.lower():
                     return customer
         return None
-    except requests.RequestException as e:
+    except http_client.RequestError as e:
         logger.error(f"Error fetching customer info: {e}")
         return None
-    
-def add_balance_to_user(customer_id, amount):
-    url = f'https://dev.sellpass.io/self/{SHOP_ID}/customers/{customer_id}/balance/add'
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    payload = {"amount": amount}
-    try:
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code == 200:
-            return f"Added ${amount} to customer ID {customer_id}.", response.status_code
-        else:
-            return response.json().get('errors', [response.text])[0], response.status_code
-    except requests.RequestException as e:
-        logger.error(f"Error adding balance: {e}")
-        return str(e), None
 
-def remove_balance_to_user(customer_id, amount):
-    url = f'https://dev.sellpass.io/self/{SHOP_ID}/customers/{customer_id}/balance/remove'
+customer_cache = CustomerCache(fetch_customer_by_email, balance_ttl=BALANCE_CACHE_TTL)
+
+async def get_customer_data_by_email(email):
+    return await customer_cache.get(email)
+
+async def remove_balance_to_user(customer_id, amount):
+    url = f'{SELLPASS_API_URL}/self/{SHOP_ID}/customers/{customer_id}/balance/remove'
     headers = {
         'Authorization': f'Bearer {API_KEY}',
         'Content-Type': 'application/json'
     }
     payload = {"amount": amount}
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = await http_client.post(url, json=payload, headers=headers, upstream="sellpass", endpoint="remove_balance")
         if response.status_code == 200:
             return f"Removed ${amount} to customer ID {customer_id}.", response.status_code
         else:
             return response.json().get('errors', [response.text])[0], response.status_code
-    except requests.RequestException as e:
-        logger.error(f"Error adding balance: {e}")
-        return str(e), None
-
-def remove_balance_by_email(email, amount):
-    url = f"https://dev.sellpass.io/self/{SHOP_ID}/customers?email={email}"
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            customers = data.get('data', [])
-            for customer in customers:
-                if customer['customer']['email'] == email:
-                    customer_id = customer.get("id")
-
-                    remove_balance_url = f'https://dev.sellpass.io/self/{SHOP_ID}/customers/{customer_id}/balance/remove'
-                    payload = {"amount": amount}
-                    balance_response = requests.post(remove_balance_url, json=payload, headers=headers)
-                    
-                    if balance_response.status_code == 200:
-                        return f"Removed ${amount} from customer ID {customer_id}.", balance_response.status_code
-                    else:
-                        return balance_response.json().get('errors', [balance_response.text])[0], balance_response.status_code
-            return f"No customer found with email {email}.", 404
-        else:
-            return f"Error fetching customer ID: {response.status_code}", response.status_code
-    except requests.RequestException as e:
+    except http_client.CircuitOpen as e:
+        # Refused before it was sent, so nothing was taken and it may be retried.
+        logger.error(f"Not removing balance: {e}")
+        return str(e), NOT_SENT
+    except http_client.RequestError as e:
         logger.error(f"Error removing balance: {e}")
         return str(e), None
-    
-def add_balance_to_user_by_email(email, amount):
-    customer_id = get_customer_id_by_email(email)
-    if customer_id:
-        return add_balance_to_user(customer_id, amount)
-    return f"Customer with email {email} not found.", None
-
-def remove_balance_to_user_by_email(email, amount):
-    customer_id = get_customer_id_by_email(email)
-    if customer_id:
-        return remove_balance_to_user(customer_id, amount)
-    return f"Customer with email {email} not found.", None
+    finally:
+        customer_cache.invalidate_balance(customer_id)
+
+order_log = OrderLog(ORDER_WAL_FILE)
+order_log.load()
+order_pipeline = OrderPipeline(order_log, remove_balance_to_user, save_order_to_file, processing_queue.append, store.has_order, notify_recovered_order)
+
+async def mark_orders_delivered(invoice_ids):
+    updated = await run_blocking("store", store.mark_delivered, invoice_ids)
+    logger.info(f"Marked {updated} orders as delivered")
+
+def notify_allocation(order):
+    # The units are set aside for the buyer, not handed over: an admin sends them.
+    notifier.send(
+        order['user_id'],
+        f"Good news! Stock for your preorder of x{order['quantity']} {order['variant_title']} is in and reserved for you. "
+        f"It will be sent to you shortly.\n"
+        f"Invoice ID: {order['invoice_id']}",
+        priority=DELIVERY, batch=True
+    )
+
+def allocation_report(orders):
+    # One line per order for the admins doing the handover, split to fit Telegram messages.
+    lines = [f"{order['invoice_id']}: x{order['quantity']} {order['variant_title']} (variant {order['variant_id']}) "
+             f"for user {order['user_id']} @{order['username']}" for order in orders]
+    header = f"Allocated {len(orders)} orders ({sum(order['quantity'] for order in orders)} units). Send these and take them off the shop's stock:"
+    chunks = [header]
+    for line in lines:
+        if len(chunks[-1]) + len(line) + 1 > MAX_TEXT_LENGTH:
+            chunks.append(line)
+        else:
+            chunks[-1] += "\n" + line
+    return chunks
+
+queue_positions_sent = {}
+
+def notify_queue_positions():
+    # Tell each waiting user where their oldest order now stands, but only when
+    # that differs from the position we last sent them.
+    global queue_positions_sent
+    positions = {}
+    for position, order in enumerate(processing_queue, 1):
+        positions.setdefault(order['user_id'], position)
+    for user_id, position in positions.items():
+        if queue_positions_sent.get(user_id) != position:
+            notifier.send(user_id, f"🔢 You are now number {position} in the delivery queue.", priority=QUEUE_UPDATE, batch=True)
+    queue_positions_sent = positions
+
+delivery_ledger = StockLedger(DELIVERY_LEDGER_FILE)
+delivery_ledger.load()
+delivery_engine = DeliveryEngine(processing_queue, delivery_ledger, variant_cache.refresh, mark_orders_delivered, notify_allocation)
+
+async def deliver_pending():
+    delivered = await delivery_engine.run()
+    if delivered and NOTIFY_QUEUE_UPDATES:
+        notify_queue_positions()
+    return delivered
+
+async def deliver_orders(context):
+    # Only scheduled when DELIVERY_INTERVAL is set; admins get the handover list.
+    allocated = await deliver_pending()
+    if allocated:
+        for chunk in allocation_report(allocated):
+            for admin_id in AUTHORIZED_USER_IDS:
+                notifier.send(admin_id, chunk, priority=DELIVERY)
+
+def data_file_sizes():
+    paths = [STORE_PATH, STORE_PATH + "-wal", journal_path(ORDER_FILE), journal_path(INVOICE_FILE),
+             ORDER_FILE, INVOICE_FILE, SESSION_FILE, ORDER_WAL_FILE, DELIVERY_LEDGER_FILE]
+    return {(path,): os.path.getsize(path) for path in paths if os.path.exists(path)}
+
+registry.gauge("bot_pending_invoices", "Invoices the poller is watching.", callback=lambda: len(invoice_poller))
+registry.gauge("bot_invoice_checks_inflight", "Invoice status checks currently running.", callback=lambda: len(invoice_poller.inflight))
+registry.gauge("bot_processing_queue_length", "Undelivered orders in the delivery queue.", callback=lambda: len(processing_queue))
+registry.gauge("bot_data_file_bytes", "Size of the order, invoice and session files.", ("path",), callback=data_file_sizes)
+registry.gauge("bot_executor_queued", "Blocking calls waiting for a worker.", ("lane",),
+               callback=lambda: {(lane,): stats['queued'] for lane, stats in executor.stats().items()})
+registry.gauge("bot_executor_wait_p99_seconds", "99th percentile wait for a worker over recent calls.", ("lane",),
+               callback=lambda: {(lane,): stats['wait_p99'] for lane, stats in executor.stats().items()})
+registry.gauge("bot_notification_backlog", "Queued outbound Telegram calls by priority.", ("priority",), callback=notifier.backlog)
 
 def generate_random_code():
     return 'BUFF-' + ''.join(random.choice(
@@ -0,0 +1,173 @@
+# http_client.py (shared keep-alive sessions for Sellpass / Hoodpay)
+import asyncio
+import json
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+import aiohttp
+from config import *
+from metrics import observe_upstream, registry
+from ratelimit import upstream_limiter, parse_limits
+from circuit import breakers, short_circuited
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_sessions = {}
+upstream_budgets = parse_limits(UPSTREAM_BUDGETS, float)
+
+hedges = registry.counter("bot_upstream_hedges_total", "Duplicate calls started because the first was slow.", ("upstream", "endpoint"))
+hedge_wins = registry.counter("bot_upstream_hedge_wins_total", "Hedged calls where the duplicate answered first.", ("upstream", "endpoint"))
+
+
+class RequestError(Exception):
+    pass
+
+
+class CircuitOpen(RequestError):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Response:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        # A proxy error page or truncated body can come back with any status.
+        try:
+            return json.loads(self.text)
+        except ValueError as e:
+            raise RequestError(f"HTTP {self.status_code}: body is not JSON: {self.text[:200]!r}") from e
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RequestError(f"HTTP {self.status_code}: {self.text}")
+
+
+def get_session(host):
+    session = _sessions.get(host)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit_per_host=HTTP_LIMIT_PER_HOST, keepalive_timeout=HTTP_KEEPALIVE)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        _sessions[host] = session
+    return session
+
+
+async def attempt(session, method, url, upstream, endpoint, breaker, kwargs):
+    # One call: observed in the metrics and reported to the endpoint's breaker.
+    if not breaker.allow():
+        short_circuited.inc(upstream=upstream, endpoint=endpoint)
+        raise CircuitOpen(f"{method} {url} not sent: {upstream} {endpoint} circuit is open", breaker.retry_after())
+    try:
+        async with upstream_limiter.slot(upstream):
+            # Latency is timed from when the call gets its slot, not while it waits for one.
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url, **kwargs) as res:
+                    response = Response(res.status, await res.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                observe_upstream(upstream, endpoint, time.perf_counter() - started, type(e).__name__)
+                breaker.failure()
+                raise
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    observe_upstream(upstream, endpoint, time.perf_counter() - started,
+                     str(response.status_code) if response.status_code >= 400 else None)
+    if response.status_code in RETRY_STATUSES:
+        breaker.failure()
+    else:
+        breaker.success()
+    return response
+
+
+async def hedged(call, delay, upstream, endpoint):
+    # If the first call hasn't answered after `delay`, a second identical one is
+    # started and the first good answer wins. Only for idempotent requests.
+    tasks = [asyncio.create_task(call())]
+    pending = set(tasks)
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            hedges.inc(upstream=upstream, endpoint=endpoint)
+            tasks.append(asyncio.create_task(call()))
+            pending.add(tasks[-1])
+        pending |= done
+        outcome = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result().status_code not in RETRY_STATUSES:
+                    if task is not tasks[0]:
+                        hedge_wins.inc(upstream=upstream, endpoint=endpoint)
+                    return task.result()
+                # Prefer reporting a real failure over the hedge being refused by the breaker.
+                if outcome is None or not isinstance(task.exception(), CircuitOpen):
+                    outcome = task
+        return outcome.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def request(method, url, retries=None, upstream=None, endpoint=None, budget=None, hedge=None, **kwargs):
+    # Only idempotent GETs are retried by default; balance POSTs must never be sent twice.
+    # upstream / endpoint label the call in the metrics and pick its circuit breaker.
+    # budget caps the whole request including retries (default per upstream from
+    # UPSTREAM_BUDGETS); hedge is the delay before a duplicate call, for GETs only.
+    if retries is None:
+        retries = HTTP_RETRIES if method == "GET" else 0
+    host = urlsplit(url).netloc
+    upstream = upstream or host
+    endpoint = endpoint or method
+    budget = budget or upstream_budgets.get(upstream)
+    breaker = breakers.get(upstream, endpoint)
+    session = get_session(host)
+
+    def call():
+        return attempt(session, method, url, upstream, endpoint, breaker, kwargs)
+
+    async def with_retries():
+        attempt_no = 0
+        while True:
+            try:
+                response = await (hedged(call, hedge, upstream, endpoint) if hedge else call())
+                if response.status_code not in RETRY_STATUSES or attempt_no >= retries:
+                    return response
+                logger.warning(f"{method} {url} returned {response.status_code}, retrying")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt_no >= retries:
+                    raise RequestError(f"{method} {url} failed: {e!r}") from e
+                logger.warning(f"{method} {url} failed: {e!r}, retrying")
+            await asyncio.sleep(HTTP_BACKOFF * 2 ** attempt_no + random.uniform(0, HTTP_BACKOFF))
+            attempt_no += 1
+
+    if not budget:
+        return await with_retries()
+    try:
+        return await asyncio.wait_for(with_retries(), budget)
+    except asyncio.TimeoutError:
+        # Inner timeouts become RequestError, so this is the budget running out.
+        breaker.failure()
+        observe_upstream(upstream, endpoint, budget, "budget")
+        raise RequestError(f"{method} {url} exceeded its {budget}s budget")
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
+
+
+async def close():
+    for session in _sessions.values():
+        await session.close()
+    _sessions.clear()
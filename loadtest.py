@@ -0,0 +1,249 @@
+# loadtest.py (replay Telegram updates against the webhook front-end)
+#
+#   python loadtest.py --users 200 --rounds 5
+#   python loadtest.py --updates recorded_updates.ndjson
+#
+# Starts a fake Bot API, launches main.py in webhook mode pointed at it, replays the
+# updates (one sequential stream per user, all users concurrently) and reports how
+# long each update took until the bot answered that chat.
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from aiohttp import web, ClientSession, ClientError
+
+BOT_TOKEN = "123456:LOADTEST"
+REPLY_METHODS = ("sendMessage", "editMessageText", "editMessageReplyMarkup", "answerCallbackQuery")
+
+
+class FakeBotApi:
+    def __init__(self):
+        self.message_ids = itertools.count(1)
+        self.waiters = collections.defaultdict(collections.deque)
+        self.calls = collections.Counter()
+        self.texts = collections.defaultdict(list)
+        self.webhook_set = asyncio.Event()
+        self.runner = None
+
+    async def params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    def message(self, chat_id, text=None):
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text or "",
+        }
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = await self.params(request)
+        self.calls[method] += 1
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+        elif method in ("sendMessage", "editMessageText"):
+            result = self.message(int(params.get("chat_id") or 0), params.get("text"))
+        elif method == "setWebhook":
+            self.webhook_set.set()
+            result = True
+        else:
+            result = True
+
+        chat_id = params.get("chat_id")
+        if method in REPLY_METHODS and chat_id is not None:
+            self.texts[int(chat_id)].append(params.get("text"))
+            self.resolve(int(chat_id))
+        return web.json_response({"ok": True, "result": result})
+
+    def expect_reply(self, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id].append(future)
+        return future
+
+    def resolve(self, chat_id):
+        waiters = self.waiters.get(chat_id)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(time.perf_counter())
+                return
+
+    async def start(self, port):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", port).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+def command_update(update_id, user_id, text):
+    update = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "User", "username": f"user{user_id}"},
+            "text": text,
+        },
+    }
+    if text.startswith("/"):
+        update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return update
+
+
+def synthetic_updates(users, rounds, commands):
+    update_ids = itertools.count(1)
+    return [
+        command_update(next(update_ids), 10_000 + user, command)
+        for _ in range(rounds)
+        for user in range(users)
+        for command in commands
+    ]
+
+
+def load_updates(path):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def update_chat_id(update):
+    for key in ("message", "edited_message"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    if "callback_query" in update:
+        return update["callback_query"]["from"]["id"]
+    return None
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def replay(api, webhook_url, secret, updates, timeout):
+    streams = collections.defaultdict(list)
+    for update in updates:
+        streams[update_chat_id(update)].append(update)
+
+    latencies = []
+    failures = 0
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+
+    async def run_stream(session, chat_id, stream):
+        nonlocal failures
+        for update in stream:
+            reply = api.expect_reply(chat_id)
+            started = time.perf_counter()
+            async with session.post(webhook_url, json=update, headers=headers) as res:
+                await res.read()
+            try:
+                latencies.append(await asyncio.wait_for(reply, timeout) - started)
+            except asyncio.TimeoutError:
+                failures += 1
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(run_stream(session, chat_id, stream) for chat_id, stream in streams.items()))
+    return latencies, failures, time.perf_counter() - started
+
+
+async def wait_for_webhook(api, url, process, timeout=30):
+    await asyncio.wait_for(api.webhook_set.wait(), timeout)
+    async with ClientSession() as session:
+        for _ in range(100):
+            if process.poll() is not None:
+                raise RuntimeError("bot exited during startup")
+            try:
+                async with session.get(url) as res:
+                    return
+            except ClientError:
+                await asyncio.sleep(0.1)
+
+
+def launch_bot(workdir, api_port, bot_port, secret, extra_env=None):
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ("preorders.json", "crypto_invoices.json"):
+        # Keep seed files the caller already put in the working directory.
+        if os.path.exists(os.path.join(here, name)) and not os.path.exists(os.path.join(workdir, name)):
+            shutil.copy(os.path.join(here, name), workdir)
+    os.makedirs(os.path.join(workdir, "buffcreditbot"), exist_ok=True)
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}/bot",
+        TELEGRAM_MODE="webhook",
+        TELEGRAM_WEBHOOK_URL=f"http://127.0.0.1:{bot_port}/telegram",
+        TELEGRAM_WEBHOOK_LISTEN="127.0.0.1",
+        TELEGRAM_WEBHOOK_PORT=str(bot_port),
+        TELEGRAM_WEBHOOK_PATH="telegram",
+        TELEGRAM_WEBHOOK_SECRET=secret,
+        STORE_PATH=os.path.join(workdir, "store.db"),
+        **(extra_env or {})
+    )
+    log = open(os.path.join(workdir, "bot_output.txt"), "a")
+    return subprocess.Popen([sys.executable, os.path.join(here, "main.py")], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def report(latencies, failures, elapsed, calls):
+    print(f"updates answered: {len(latencies)}  timed out: {failures}  wall time: {elapsed:.2f}s")
+    if latencies:
+        print(f"throughput: {len(latencies) / elapsed:.1f} updates/s")
+        print(f"latency p50: {percentile(latencies, 0.5) * 1000:.1f} ms  p99: {percentile(latencies, 0.99) * 1000:.1f} ms  max: {max(latencies) * 1000:.1f} ms")
+    print("bot api calls:", dict(calls))
+
+
+async def run(args):
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.users, args.rounds, args.commands.split(","))
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    secret = "loadtest-secret"
+    api = FakeBotApi()
+    await api.start(args.api_port)
+    process = launch_bot(workdir, args.api_port, args.bot_port, secret)
+    webhook_url = f"http://127.0.0.1:{args.bot_port}/telegram"
+    try:
+        await wait_for_webhook(api, webhook_url, process)
+        latencies, failures, elapsed = await replay(api, webhook_url, secret, updates, args.timeout)
+        report(latencies, failures, elapsed, api.calls)
+    finally:
+        process.terminate()
+        process.wait()
+        await api.stop()
+        print(f"bot output: {os.path.join(workdir, 'bot_output.txt')}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay Telegram updates against the bot in webhook mode.")
+    parser.add_argument("--updates", help="NDJSON file with one recorded Telegram update per line")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--commands", default="/start,/status,/queue")
+    parser.add_argument("--api-port", type=int, default=8090)
+    parser.add_argument("--bot-port", type=int, default=8091)
+    parser.add_argument("--timeout", type=float, default=10)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
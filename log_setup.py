@@ -0,0 +1,124 @@
+# log_setup.py (queue-based logging with JSON records and correlation ids)
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+
+CORRELATION_FIELDS = ("user_id", "update_id", "invoice_id", "hoodpay_id")
+
+log_fields = contextvars.ContextVar("log_fields", default={})
+
+_listener = None
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    # Everything logged inside the block (including by awaited coroutines) carries these fields.
+    token = log_fields.set({**log_fields.get(), **fields})
+    try:
+        yield
+    finally:
+        try:
+            log_fields.reset(token)
+        except ValueError:
+            # A coroutine closed at shutdown outside the task that entered the block.
+            pass
+
+
+class ContextFilter(logging.Filter):
+    # Attached to the queue handler, so it runs in the logging task and sees its context.
+    def filter(self, record):
+        for field, value in log_fields.get().items():
+            if not hasattr(record, field):
+                setattr(record, field, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    # Records logged with extra={"sample": key} are kept once every `every` times per key.
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, every)
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        with self.lock:
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+        if count % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CORRELATION_FIELDS + ("sampled",):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        fields = " ".join(f"{field}={getattr(record, field)}" for field in CORRELATION_FIELDS if getattr(record, field, None) is not None)
+        return f"{line} [{fields}]" if fields else line
+
+
+def setup_logging(path, level=logging.INFO, max_bytes=10 * 1024 * 1024, backups=5, sample_every=20, file_format="json"):
+    # Handlers only run on the listener thread, so the event loop never waits on disk or stdout.
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    text_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    file_handler.setFormatter(JsonFormatter() if file_format == "json" else TextFormatter(text_format))
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(TextFormatter(text_format))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_every))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -3,9 +3,15 @@ from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandle
 from config import *
 from telegram.constants import ParseMode
 from telegram.error import NetworkError, TelegramError
-from captcha_solver import solve_captcha
+from captcha_solver import solve_captcha, captcha_client
+from captcha_pool import CaptchaPool
+from update_processor import PerUserUpdateProcessor
+from persistence import SqlitePersistence
+from cache import VARIANT_TOKEN_PREFIX
+from metrics import timed, registry, metrics_server
+from ratelimit import admit
+from log_setup import setup_logging
 from datetime import datetime, timezone
-from collections import deque
 import threading
 from func import *
 import asyncio
@@ -13,25 +19,24 @@ import logging
 import aiohttp
 import re
 import json
-import requests
+import http_client
 import jwt
 
-processing_queue = deque()
 AUTHORIZED_USER_IDS = [5847781069, 5211092406]
 MAX_OTP_ATTEMPTS = 3
+queue_snapshots = {}
+captcha_pool = CaptchaPool(solve_captcha, CAPTCHA_POOL_SIZE, CAPTCHA_TOKEN_MAX_AGE, CAPTCHA_POOL_IDLE)
+registry.gauge("bot_captcha_pool_tokens", "Pre-solved captcha tokens ready to hand out.", callback=lambda: len(captcha_pool.tokens))
+# Buttons that call upstreams, and which ones; checked by admit() before the click is answered.
+BUTTON_UPSTREAMS = {"crypto": ("sellpass", "hoodpay"), "coin": ("hoodpay",), "balance": ("sellpass",)}
+SHOP_UNAVAILABLE_MESSAGE = "⚠️ Could not reach the shop right now."
+INVALID_BUTTON_MESSAGE = "Sorry, I could not process this button click 😕 Please send /start to get a new keyboard."
 
 
 ORDER_FILE = "preorders.json"
 INVOICE_FILE = "crypto_invoices.json"
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log', mode='a'),
-        logging.StreamHandler()
-    ]
-)
+setup_logging(LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUPS, LOG_SAMPLE_EVERY, LOG_FORMAT)
 logger = logging.getLogger(__name__)
 
 
@@ -43,6 +48,7 @@ def log_command(update: Update, context: CallbackContext, command_name: str) ->
     user = update.message.from_user
     logger.info("Command from (%s) (@%s): %s", user.id, user.username, update.message.text)
 
+@timed('start')
 async def start(update: Update, context):
     log_command(update, context, 'start')
     welcome_message = """
@@ -62,7 +68,9 @@ Welcome to Buffed Credit Bot! Here are the available commands:
 4. /preorder - Preorder an item from the shop.
 5. /reset <telegram_user_id> - Admin command to reset a user's login.
 6. /queue - Check your position in the delivery queue.
-7. /fullqueue - View the full delivery queue.
+7. /fullqueue [summary | variant=<id> | method=<payment_method>] - View the full delivery queue.
+8. /refreshvariants - Reload the variant list from the shop.
+9. /deliver - Reserve in-stock units for waiting preorders and list them for handover.
     """
     
     if update.message.from_user.id in AUTHORIZED_USER_IDS:
@@ -70,6 +78,7 @@ Welcome to Buffed Credit Bot! Here are the available commands:
     else:
         await update.message.reply_text(welcome_message)
 
+@timed('login')
 async def login(update: Update, context):
     user_id = update.message.from_user.id
     valid_accounts = load_user_data(user_id)
@@ -83,41 +92,45 @@ async def login(update: Update, context):
     await update.message.reply_text(text="Please enter your email:")
 
 async def handle_captcha_solution(update: Update, context, email):
-    recaptcha_token = await solve_captcha()
+    try:
+        recaptcha_token = await captcha_pool.checkout()
 
-    if recaptcha_token:
-        otp_request_status = send_otp_request(email, recaptcha_token)
+        if recaptcha_token:
+            otp_request_status = await send_otp_request(email, recaptcha_token)
 
-        if otp_request_status:
-            await update.message.reply_text("OTP sent to your email. Please enter the 6-digit OTP:")
-            context.user_data['state'] = 'waiting_for_otp'
+            if otp_request_status:
+                await update.message.reply_text("OTP sent to your email. Please enter the 6-digit OTP:")
+                context.user_data['state'] = 'waiting_for_otp'
+            else:
+                await update.message.reply_text("Failed to send OTP. Please try again.")
+                context.user_data['state'] = 'waiting_for_email'
         else:
-            await update.message.reply_text("Failed to send OTP. Please try again.")
+            await update.message.reply_text("Captcha solving failed.")
             context.user_data['state'] = 'waiting_for_email'
-    else:
-        await update.message.reply_text("Captcha solving failed.")
-        context.user_data['state'] = 'waiting_for_email'
+    finally:
+        # This runs after the handler returned, so flag the final state for persistence ourselves.
+        context.application.mark_data_for_update_persistence(user_ids=update.effective_user.id)
 
-def send_otp_request(email, recaptcha_token):
+async def send_otp_request(email, recaptcha_token):
     postdata = {
         "email": email,
         "recaptcha": recaptcha_token,
         "referralCode": None
     }
-    url = f"https://api.sellpass.io/{SHOP_ID}/customers/auth/otp/request/"
+    url = f"{SELLPASS_STORE_API_URL}/{SHOP_ID}/customers/auth/otp/request/"
 
     try:
-        response = requests.post(url, json=postdata)
+        response = await http_client.post(url, json=postdata, upstream="sellpass", endpoint="otp_request")
         if response.status_code == 200:
             return True
         else:
             print(f"OTP Request failed: {response.text}")
             return False
-    except requests.exceptions.RequestException as e:
+    except http_client.RequestError as e:
         print(f"Error in OTP request: {e}")
         return False
 
-def verify_otp(email, otp, recaptcha_token, update):
+async def verify_otp(email, otp, recaptcha_token, update):
     postdata = {
         "email": email,
         "otp": otp,
@@ -125,10 +138,10 @@ def verify_otp(email, otp, recaptcha_token, update):
         "referralCode": None,
         "tsId": None
     }
-    url = f"https://api.sellpass.io/{SHOP_ID}/customers/auth/otp/login/"
+    url = f"{SELLPASS_STORE_API_URL}/{SHOP_ID}/customers/auth/otp/login/"
 
     try:
-        response = requests.post(url, json=postdata)
+        response = await http_client.post(url, json=postdata, upstream="sellpass", endpoint="otp_login")
         if response.status_code == 200:
             data = response.json()
             token = data["data"]
@@ -136,16 +149,17 @@ def verify_otp(email, otp, recaptcha_token, update):
             expiry_date = datetime.fromtimestamp(expiry)
             expiry_time = datetime.fromtimestamp(expiry, tz=timezone.utc)
 
-            save_user_data(email, update.effective_user.id, token, expiry_date, expiry)
+            await save_user_data(email, update.effective_user.id, token, expiry_date, expiry)
 
             return True, expiry_time
         else:
             print(f"OTP Verification failed: {response.text}")
             return False, None
-    except requests.exceptions.RequestException as e:
+    except http_client.RequestError as e:
         print(f"Error in OTP verification: {e}")
         return False, None
 
+@timed('status')
 async def status(update: Update, context: CallbackContext) -> None:
     log_command(update, context, 'status')
     user_id = update.message.from_user.id
@@ -158,6 +172,7 @@ async def status(update: Update, context: CallbackContext) -> None:
     
     await update.message.reply_text(f"Logged in as: {valid_accounts[0]['email']}, your session expires in {valid_accounts[0]['expiry']}")
 
+@timed('logout')
 async def logout(update: Update, context: CallbackContext) -> None:
     log_command(update, context, 'logout')
     user_id = update.message.from_user.id
@@ -167,24 +182,16 @@ async def logout(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("You're not logged in. Please use /login to log in.")
         return
     
-    try:
-        with open("buffcreditbot/user_data.txt", "r") as file:
-            user_data = [json.loads(line) for line in file.readlines()]
-        
-        with open("buffcreditbot/user_data.txt", "w") as file:
-            for data in user_data:
-                if data["user_id"] != update.effective_user.id:
-                    file.write(json.dumps(data) + "\n")
-
-        await update.effective_message.reply_text("Logged out successfully!")
-    except FileNotFoundError:
-        pass
+    await remove_user_data(user_id)
+    await update.effective_message.reply_text("Logged out successfully!")
 
+@timed('cancel')
 async def cancel(update: Update, context):
     log_command(update, context, 'cancel')
     context.user_data.clear()
     await update.effective_message.reply_text("Cancelled!")
 
+@timed('reset')
 async def reset(update: Update, context: CallbackContext) -> None:
     log_command(update, context, 'reset')
     
@@ -196,29 +203,24 @@ async def reset(update: Update, context: CallbackContext) -> None:
             await update.message.reply_text("Usage: /reset <telegram_user_id>")
             return
 
-        target_user_id = args[0]
-        valid_accounts = load_user_data(target_user_id)
+        try:
+            target_user_id = int(args[0])
+        except ValueError:
+            await update.message.reply_text("Usage: /reset <telegram_user_id>")
+            return
 
-        if not valid_accounts:
-            await update.message.reply_text("No active session found for user {target_user_id}.")
+        if not await remove_user_data(target_user_id):
+            await update.message.reply_text(f"No active session found for user {target_user_id}.")
             return
-        
-        try:
-            with open("buffcreditbot/user_data.txt", "r") as file:
-                user_data = [json.loads(line) for line in file.readlines()]
-            
-            with open("buffcreditbot/user_data.txt", "w") as file:
-                for data in user_data:
-                    if data["user_id"] != update.effective_user.id:
-                        file.write(json.dumps(data) + "\n")
-
-            await update.message.reply_text(f"User {target_user_id}'s email login has been reset.")
-            logger.info(f"Admin {user_id} reset login for user {target_user_id}")
-        except FileNotFoundError:
-            pass
 
+        await update.message.reply_text(f"User {target_user_id}'s email login has been reset.")
+        logger.info(f"Admin {user_id} reset login for user {target_user_id}")
+
+@timed('preorder')
 async def preorder(update: Update, context: CallbackContext) -> None:
     log_command(update, context, 'preorder')
+    if not await admit(update, 'preorder', ("sellpass",)):
+        return
     user_id = update.message.from_user.id
    
     valid_accounts = load_user_data(user_id)
@@ -231,12 +233,12 @@ async def preorder(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("Multiple logged in accounts found. Please use /logout and log in again.")
         return
     
-    variants = get_variants()
+    variants = await variant_cache.get()
     
     keyboard = [
         [InlineKeyboardButton(
             text=f"💰 {variant['title']} - ${variant['price']}", 
-            callback_data=f"preordero,{variant['id']},{variant['title']},{variant['stock']},{variant['price']},{variant['min_amount']},{variant['max_amount']}"
+            callback_data=variant_cache.token(variant)
         )]
         for variant in variants
     ]
@@ -245,30 +247,45 @@ async def preorder(update: Update, context: CallbackContext) -> None:
     
     await update.message.reply_text("Select a variant to preorder:", reply_markup=reply_markup)
 
+def button_branch(update, context):
+    data = update.callback_query.data or ""
+    if data.startswith(VARIANT_TOKEN_PREFIX):
+        return "variant"
+    if data.startswith("fq:"):
+        return "queue_page"
+    if data.startswith("coin_"):
+        return "coin"
+    return data if data in ("crypto", "balance") else "other"
+
+@timed('button', branch=button_branch)
 async def button(update: Update, context):
     query = update.callback_query
+    branch = button_branch(update, context)
+    if branch in BUTTON_UPSTREAMS and not await admit(update, branch, BUTTON_UPSTREAMS[branch]):
+        return
     await query.answer()
 
-    if query.data.startswith("preordero,"):
-        variant_data = query.data.split(',')
-        variant_id = variant_data[1]
-        variant_title = variant_data[2]
-        stock = int(variant_data[3])
-        price = float(variant_data[4])
-        minamount = variant_data[5]
-        maxamount = variant_data[6]
-        
-        
-        context.user_data['variant_id'] = variant_id
+    if query.data.startswith(VARIANT_TOKEN_PREFIX):
+        await variant_cache.get()
+        variant = variant_cache.resolve_token(query.data)
+        if variant is None:
+            # Gone from the shop since the keyboard was sent.
+            await query.edit_message_text(INVALID_BUTTON_MESSAGE)
+            return
+        variant_title = variant['title']
+        minamount = variant['min_amount']
+
+        context.user_data['variant_id'] = str(variant['id'])
         context.user_data['variant_title'] = variant_title
-        context.user_data['variant_stock'] = stock
-        context.user_data['variant_price'] = price
+        context.user_data['variant_stock'] = int(variant['stock'])
+        context.user_data['variant_price'] = float(variant['price'])
         context.user_data['variant_minAmount'] = minamount
-        context.user_data['variant_maxAmount'] = maxamount
-        
-        
+        context.user_data['variant_maxAmount'] = variant['max_amount']
+
         context.user_data['state'] = 'waiting_for_amount'
         await update.effective_chat.send_message(f"You selected: {variant_title}.\n\nPlease enter the amount you would like to preorder. (Min: {minamount})")
+    elif query.data.startswith("fq:"):
+        await handle_queue_page(query, int(query.data[3:]))
     elif query.data.startswith("coin_"):
         crypto_map = {
         'coin_LTC': 'LITECOIN',
@@ -291,7 +308,7 @@ async def button(update: Update, context):
         valid_accounts = load_user_data(update.effective_user.id)
 
         if not valid_accounts:
-            await update.message.reply_text("You're not logged in. Please use /login to log in.")
+            await query.edit_message_text("You're not logged in. Please use /login to log in.")
             return
         
         api_token = valid_accounts[0]['token']
@@ -311,13 +328,13 @@ async def button(update: Update, context):
             "tsId": None
         }
         try:
-            response = requests.post(f'https://api.sellpass.io/{SHOP_ID}/customers/dashboard/balance/topup', json=postdata, headers=headers)
+            response = await http_client.post(f'{SELLPASS_STORE_API_URL}/{SHOP_ID}/customers/dashboard/balance/topup', json=postdata, headers=headers, upstream="sellpass", endpoint="topup")
             if response.status_code == 200:
                 response_data = response.json()
                 invoice_id = response_data.get('data', {})
                 
                 if invoice_id:
-                    hoodpay_url, hoodpay_id = get_invoice(invoice_id)
+                    hoodpay_url, hoodpay_id = await get_invoice(invoice_id)
                     
                     context.user_data['sellpass_id'] = invoice_id
                     context.user_data['hoodpay_url'] = hoodpay_url
@@ -339,7 +356,7 @@ async def button(update: Update, context):
             else:
                 logger.error(f"Failed to create balance invoice: {response.status_code} {response.text}")
                 await query.edit_message_text("Failed to process the top-up request. Please try again.")
-        except requests.RequestException as e:
+        except http_client.RequestError as e:
             logger.error(f"Error while creating balance invoice: {e}")
             await query.edit_message_text("An unexpected error occurred. Please try again.")
     elif query.data == 'balance':
@@ -354,11 +371,15 @@ async def button(update: Update, context):
         valid_accounts = load_user_data(update.effective_user.id)
 
         if not valid_accounts:
-            await update.message.reply_text("You're not logged in. Please use /login to log in.")
+            await query.edit_message_text("You're not logged in. Please use /login to log in.")
             return
 
         email = valid_accounts[0]['email']
-        user_balance = get_customer_data_by_email(email)
+        user_balance = await get_customer_data_by_email(email)
+        if user_balance is None:
+            # Keep the buttons so the user can try again once Sellpass answers.
+            await query.edit_message_text(SHOP_UNAVAILABLE_MESSAGE, reply_markup=query.message.reply_markup)
+            return
         balances = user_balance.get("customerForShopAccount", {}).get("balances", [{}])[0]
         real_balance = balances.get("realBalance", 0)
         manual_balance = balances.get("manualBalance", 0)
@@ -371,30 +392,40 @@ async def button(update: Update, context):
             context.user_data.clear()
             return
         
-        _ , status = remove_balance_by_email(email, total_price)
-
-        if status == 200:
-            invoice_id = generate_invoice_id()
-            user = update.effective_user
-            order_data = {
-                "user_id": user.id,
-                "username": str(user.username),
-                "variant_id": variant_id,
-                "variant_title": variant_title,
-                "quantity": quantity,
-                "payment_method": 'balance',
-                "timestamp": datetime.now().isoformat(),
-                "invoice_id": invoice_id,
-                "delivered": False
-            }
-
-            save_order_to_file(order_data)
-            processing_queue.append(order_data)
+        customer_id = await get_customer_id_by_email(email)
+        # The key is fixed when the amount is chosen, so a repeated click can't charge twice.
+        invoice_id = context.user_data.get('order_key') or generate_invoice_id()
+        user = update.effective_user
+        order_data = {
+            "user_id": user.id,
+            "username": str(user.username),
+            "variant_id": variant_id,
+            "variant_title": variant_title,
+            "quantity": quantity,
+            "payment_method": 'balance',
+            "timestamp": datetime.now().isoformat(),
+            "invoice_id": invoice_id,
+            "delivered": False
+        }
+
+        success = False
+        if customer_id is not None:
+            success, message = await order_pipeline.run(invoice_id, order_data, customer_id, total_price)
+
+        if success:
             await query.edit_message_text(f"Your order for x{quantity} {variant_title} has been saved.\nInvoice ID: {invoice_id}\nIt will be delivered when the stock is available!")
+        elif order_pipeline.retrying(invoice_id):
+            # Nothing was charged yet; the order is retried in the background and the user told how it ends.
+            await query.edit_message_text(f"The shop is not responding right now. Your order for x{quantity} {variant_title} will be charged and placed as soon as it is back.\nInvoice ID: {invoice_id}")
+            context.user_data.clear()
         else:
             await query.edit_message_text(f"Failed to process the payment. Please try again.")
             context.user_data.clear()
 
+def message_branch(update, context):
+    return (context.user_data or {}).get('state') or "none"
+
+@timed('message', branch=message_branch)
 async def message_handler(update: Update, context):
     state = context.user_data.get('state')
     
@@ -411,6 +442,7 @@ async def message_handler(update: Update, context):
             return
         
         context.user_data['amount'] = amount
+        context.user_data['order_key'] = generate_invoice_id()
         
         valid_accounts = load_user_data(update.effective_user.id)
 
@@ -419,7 +451,11 @@ async def message_handler(update: Update, context):
             return
 
         email = valid_accounts[0]['email']
-        user_balance = get_customer_data_by_email(email.lower())
+        user_balance = await get_customer_data_by_email(email.lower())
+        if user_balance is None:
+            await update.message.reply_text(f"{SHOP_UNAVAILABLE_MESSAGE} Please enter the amount again.")
+            context.user_data['state'] = 'waiting_for_amount'
+            return
         balances = user_balance.get("customerForShopAccount", {}).get("balances", [{}])[0]
         real_balance = balances.get("realBalance", 0)
         manual_balance = balances.get("manualBalance", 0)
@@ -436,6 +472,8 @@ async def message_handler(update: Update, context):
         log_command(update, context, 'login')
         email = update.message.text
         if re.match(r"[^@]+@[^@]+\.[^@]+", email):
+            if not await admit(update, 'login', ("capsolver", "sellpass")):
+                return
             await update.message.reply_text("Email validated. Solving captcha and requesting OTP...")
 
             context.user_data['state'] = 'waiting_for_captcha'
@@ -454,14 +492,16 @@ async def message_handler(update: Update, context):
             return
 
         if len(otp) == 6 and otp.isdigit():
+            if not await admit(update, 'otp', ("capsolver", "sellpass")):
+                return
             context.user_data['otp_attempts'] += 1
             await update.message.reply_text("Validating OTP...")
 
             email = context.user_data.get('email')
-            recaptcha_token = await solve_captcha()
+            recaptcha_token = await captcha_pool.checkout()
 
             if recaptcha_token:
-                otp_verification_status, expiry_time = verify_otp(email, otp, recaptcha_token, update)
+                otp_verification_status, expiry_time = await verify_otp(email, otp, recaptcha_token, update)
 
                 if otp_verification_status:
                     context.user_data['state'] = None
@@ -474,36 +514,54 @@ async def message_handler(update: Update, context):
         else:
             await update.message.reply_text(f"Invalid OTP format. {MAX_OTP_ATTEMPTS - context.user_data['otp_attempts']} attempts left.")
 
+@timed('invalid_button')
 async def handle_invalid_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.callback_query.answer()
-    await update.effective_message.edit_text(
-        "Sorry, I could not process this button click 😕 Please send /start to get a new keyboard."
-    )
+    await update.effective_message.edit_text(INVALID_BUTTON_MESSAGE)
 
+@timed('queue')
 async def my_queue_position(update: Update, context: CallbackContext):
     log_command(update, context, 'queue')
     user_id = update.effective_user.id
 
-    with open(ORDER_FILE, 'r') as file:
-        try:
-            orders = json.load(file)
-        except json.JSONDecodeError:
-            orders = []
-
-    processing_queue.clear()
-    for order in orders:
-        if not order['delivered']:
-            processing_queue.append(order)
-
-    position = 1
-    for order in processing_queue:
-        if order['user_id'] == user_id:
-            await update.message.reply_text(f"🔢 You are currently number {position} in the delivery queue.")
-            return
-        position += 1
+    position = processing_queue.position(user_id)
+    if position is not None:
+        await update.message.reply_text(f"🔢 You are currently number {position} in the delivery queue.")
+        return
 
     await update.message.reply_text("You are not in the delivery queue or your order has already been processed.")
 
+def queue_filter(args):
+    filters_ = {}
+    for arg in args:
+        key, _, value = arg.partition('=')
+        if key in ('variant', 'method') and value:
+            filters_[key] = value
+        else:
+            return None
+    return filters_
+
+def queue_page_markup(page, pages):
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"fq:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"fq:{page + 1}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def render_queue_page(snapshot, page):
+    orders = snapshot['orders']
+    pages = max(1, -(-len(orders) // QUEUE_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * QUEUE_PAGE_SIZE
+    lines = [
+        f"{index + 1}. {order['username']} - x{order['quantity']} {order['variant_title']} (ID: {order['invoice_id']})"
+        for index, order in enumerate(orders[start:start + QUEUE_PAGE_SIZE], start)
+    ]
+    header = f"📋 {snapshot['title']} ({len(orders)} orders, page {page + 1}/{pages}, as of {snapshot['taken']})"
+    return f"{header}\n\n" + "\n".join(lines), queue_page_markup(page, pages)
+
+@timed('fullqueue')
 async def view_full_queue(update: Update, context: CallbackContext):
     log_command(update, context, 'fullqueue')
     user_id = update.message.from_user.id
@@ -512,20 +570,140 @@ async def view_full_queue(update: Update, context: CallbackContext):
             await update.message.reply_text("The queue is currently empty.")
             return
 
-        queue_list = "\n".join([f"{index + 1}. {order['username']} (ID: {order['invoice_id']})" for index, order in enumerate(processing_queue)])
-        await update.message.reply_text(f"📋 Current Queue:\n\n{queue_list}")
+        if context.args == ['summary']:
+            lines = [
+                f"{summary['title']} ({variant_id}): {summary['orders']} orders, {summary['quantity']} units"
+                for variant_id, summary in processing_queue.summary().items()
+            ]
+            await update.message.reply_text(f"📋 Queue by variant ({len(processing_queue)} orders):\n\n" + "\n".join(lines))
+            return
 
-async def delete_message_after_delay(context, stock_message):
-    await asyncio.sleep(5)
-    await context.bot.delete_message(stock_message.chat.id, stock_message.message_id)
+        filters_ = queue_filter(context.args)
+        if filters_ is None:
+            await update.message.reply_text("Usage: /fullqueue [summary | variant=<variant_id> | method=<payment_method>]")
+            return
+
+        orders = [
+            order for order in processing_queue
+            if order['variant_id'] == filters_.get('variant', order['variant_id'])
+            and str(order['payment_method']).lower() == filters_.get('method', str(order['payment_method'])).lower()
+        ]
+        if not orders:
+            await update.message.reply_text("No queued orders match that filter.")
+            return
+
+        title = "Current Queue" + "".join(f" [{key}={value}]" for key, value in filters_.items())
+        queue_snapshots[user_id] = {'orders': orders, 'title': title, 'taken': datetime.now().strftime("%H:%M:%S")}
+        text, reply_markup = render_queue_page(queue_snapshots[user_id], 0)
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def handle_queue_page(query, page):
+    snapshot = queue_snapshots.get(query.from_user.id)
+    if query.from_user.id not in AUTHORIZED_USER_IDS or snapshot is None:
+        await query.edit_message_text("This queue view has expired. Please use /fullqueue again.")
+        return
+    text, reply_markup = render_queue_page(snapshot, page)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+@timed('refreshvariants')
+async def refresh_variants(update: Update, context: CallbackContext):
+    log_command(update, context, 'refreshvariants')
+    user_id = update.message.from_user.id
+    if user_id in AUTHORIZED_USER_IDS:
+        # A failed refresh leaves the current list in place.
+        variants = await variant_cache.refresh()
+        stats = variant_cache.stats()
+        if variants:
+            summary = f"Loaded {len(variants)} variants."
+        else:
+            summary = f"Refresh failed, still serving {len(variant_cache.variants or [])} cached variants."
+        await update.message.reply_text(
+            f"{summary}\n\n"
+            f"Cache hits: {stats['hits']} (stale: {stats['stale_hits']}), misses: {stats['misses']}, "
+            f"refreshes: {stats['refreshes']}, failed refreshes: {stats['failures']}"
+        )
+
+@timed('deliver')
+async def deliver_now(update: Update, context: CallbackContext):
+    log_command(update, context, 'deliver')
+    if update.message.from_user.id not in AUTHORIZED_USER_IDS:
+        return
+    allocated = await deliver_pending()
+    if not allocated:
+        await update.message.reply_text(f"Nothing to allocate. {len(processing_queue)} orders are still waiting for stock.")
+        return
+    for chunk in allocation_report(allocated):
+        await update.message.reply_text(chunk)
+    await update.message.reply_text(f"{len(processing_queue)} orders are still waiting for stock.")
+
+@timed('executorstats')
+async def executor_stats(update: Update, context: CallbackContext):
+    log_command(update, context, 'executorstats')
+    if update.message.from_user.id not in AUTHORIZED_USER_IDS:
+        return
+    lines = []
+    for lane, stats in executor.stats().items():
+        lines.append(
+            f"{lane}: {stats['queued']} queued, {stats['running']}/{stats['limit']} running, {stats['calls']} calls, "
+            f"wait p50 {stats['wait_p50'] * 1000:.1f} ms / p99 {stats['wait_p99'] * 1000:.1f} ms / max {stats['wait_max'] * 1000:.1f} ms"
+        )
+    await update.message.reply_text("\n".join(lines) or "No blocking calls yet.")
 
 def schedule_startup_jobs(app):
     job_queue = app.job_queue
     job_queue.run_once(monitor_pending_invoices, when=0)
+    job_queue.run_repeating(reap_expired_sessions, interval=SESSION_REAP_INTERVAL, first=SESSION_REAP_INTERVAL)
+    job_queue.run_repeating(retry_orders, interval=ORDER_RETRY_INTERVAL, first=ORDER_RETRY_INTERVAL)
+    if DELIVERY_INTERVAL > 0:
+        job_queue.run_repeating(deliver_orders, interval=DELIVERY_INTERVAL, first=DELIVERY_INTERVAL)
+    if STORE_BACKEND == "journal":
+        job_queue.run_repeating(compact_store, interval=JOURNAL_COMPACT_INTERVAL, first=JOURNAL_COMPACT_INTERVAL)
     print("Scheduled pending invoice monitoring.")
 
+def resume_flows(app):
+    # A captcha solve doesn't survive a restart; let those users send their email again.
+    for user_id, user_data in app.user_data.items():
+        if user_data.get('state') == 'waiting_for_captcha':
+            user_data['state'] = 'waiting_for_email'
+            app.mark_data_for_update_persistence(user_ids=user_id)
+
+async def startup(app):
+    resume_flows(app)
+    # Warm the variant list so buttons on keyboards sent before a restart resolve at once.
+    await variant_cache.get()
+    captcha_pool.start()
+    notifier.start(app.bot)
+    if METRICS_PORT:
+        try:
+            await metrics_server.start(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            # Metrics are optional; a taken port shouldn't keep the bot from starting.
+            logger.warning(f"Metrics server not started on {METRICS_HOST}:{METRICS_PORT}: {e}")
+            await metrics_server.stop()
+    if HOODPAY_WEBHOOK_SECRET:
+        await hoodpay_webhook.start(HOODPAY_WEBHOOK_HOST, HOODPAY_WEBHOOK_PORT)
+
+async def shutdown(app):
+    await captcha_pool.stop()
+    await notifier.stop()
+    await metrics_server.stop()
+    await captcha_client.close()
+    await hoodpay_webhook.stop()
+    await invoice_poller.stop()
+    await http_client.close()
+    executor.shutdown()
+
 def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+        .persistence(SqlitePersistence(USER_STATE_PATH, USER_STATE_FLUSH_INTERVAL, USER_STATE_MAX_AGE))
+        .post_init(startup)
+        .post_shutdown(shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler('start', start))
     app.add_handler(CommandHandler('help', start))
     app.add_handler(CommandHandler('login', login))
@@ -537,15 +715,27 @@ def main():
     app.add_handler(CommandHandler('preorder', preorder))
     app.add_handler(CommandHandler('queue', my_queue_position))
     app.add_handler(CommandHandler('fullqueue', view_full_queue))
+    app.add_handler(CommandHandler('refreshvariants', refresh_variants))
+    app.add_handler(CommandHandler('executorstats', executor_stats))
+    app.add_handler(CommandHandler('deliver', deliver_now))
     app.add_handler(CallbackQueryHandler(handle_invalid_button, pattern=InvalidCallbackData))
+    app.add_handler(CallbackQueryHandler(handle_invalid_button, pattern=variant_cache.is_stale_token))
     app.add_handler(CallbackQueryHandler(button))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
 
 
     try:
         schedule_startup_jobs(app)
-        app.run_polling()
-        remove_expired_tokens()
+        if TELEGRAM_MODE == "webhook":
+            app.run_webhook(
+                listen=TELEGRAM_WEBHOOK_LISTEN,
+                port=TELEGRAM_WEBHOOK_PORT,
+                url_path=TELEGRAM_WEBHOOK_PATH,
+                webhook_url=TELEGRAM_WEBHOOK_URL,
+                secret_token=TELEGRAM_WEBHOOK_SECRET
+            )
+        else:
+            app.run_polling()
         print('Bot is now Online!')
     except NetworkError:
         print("Network error occurred. Retrying...")
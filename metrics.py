@@ -0,0 +1,187 @@
+# metrics.py (Prometheus text-format metrics served over HTTP)
+import functools
+import logging
+import threading
+import time
+from aiohttp import web
+from config import *
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            return self.header() + [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    # Either set() directly, or give a callback returning {label values tuple: value}
+    # (or a plain number when there are no labels) that is read on every scrape.
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def render(self):
+        values = dict(self.values)
+        if self.callback:
+            try:
+                current = self.callback()
+            except Exception:
+                logger.exception(f"Reading gauge {self.name} failed")
+                current = {}
+            values.update(current if isinstance(current, dict) else {(): current})
+        return self.header() + [f"{self.name}{format_labels(self.labels, key)} {value}" for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', bound)])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), callback=None):
+        return self.register(Gauge(name, help, labels, callback))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram("bot_handler_seconds", "Time spent in a Telegram update handler.", ("handler", "branch"))
+handler_errors = registry.counter("bot_handler_errors_total", "Handler calls that raised.", ("handler", "branch"))
+upstream_seconds = registry.histogram("bot_upstream_seconds", "Latency of calls to Sellpass, Hoodpay and CapSolver.", ("upstream", "endpoint"))
+upstream_errors = registry.counter("bot_upstream_errors_total", "Failed upstream calls by reason (HTTP status or error type).", ("upstream", "endpoint", "reason"))
+
+
+def timed(handler, branch=None):
+    # Wraps a handler; branch(update, context) picks the branch label before the handler runs.
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            label = branch(update, context) if branch else ""
+            started = time.perf_counter()
+            try:
+                return await func(update, context, *args, **kwargs)
+            except Exception:
+                handler_errors.inc(handler=handler, branch=label)
+                raise
+            finally:
+                handler_seconds.observe(time.perf_counter() - started, handler=handler, branch=label)
+        return wrapper
+    return decorator
+
+
+def observe_upstream(upstream, endpoint, seconds, error=None):
+    upstream_seconds.observe(seconds, upstream=upstream, endpoint=endpoint)
+    if error is not None:
+        upstream_errors.inc(upstream=upstream, endpoint=endpoint, reason=error)
+
+
+class MetricsServer:
+    def __init__(self, registry, path=METRICS_PATH):
+        self.registry = registry
+        self.path = path
+        self.runner = None
+
+    async def handle(self, request):
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self, host, port):
+        app = web.Application()
+        app.router.add_get(self.path, self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info(f"Serving metrics on http://{host}:{port}{self.path}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+metrics_server = MetricsServer(registry)
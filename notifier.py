@@ -0,0 +1,226 @@
+# notifier.py (rate-limited outbound Telegram messages)
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import timedelta
+from telegram.error import RetryAfter, NetworkError, Forbidden, BadRequest
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Lower sends first.
+PAYMENT = 0
+DELIVERY = 1
+NORMAL = 2
+QUEUE_UPDATE = 3
+HOUSEKEEPING = 4
+PRIORITY_NAMES = {PAYMENT: "payment", DELIVERY: "delivery", NORMAL: "normal", QUEUE_UPDATE: "queue_update", HOUSEKEEPING: "housekeeping"}
+
+MAX_TEXT_LENGTH = 4096
+
+sent_total = registry.counter("bot_notifications_sent_total", "Outbound Telegram calls made by the notifier.", ("priority", "method"))
+failed_total = registry.counter("bot_notifications_failed_total", "Outbound Telegram calls dropped after errors.", ("priority", "reason"))
+flood_waits = registry.counter("bot_notifications_retry_after_total", "RetryAfter responses from Telegram.")
+queue_wait = registry.histogram("bot_notification_wait_seconds", "Time from enqueue to send.", ("priority",),
+                                buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+
+
+class Job:
+    def __init__(self, priority, chat_id, method, kwargs, batch, future):
+        self.priority = priority
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.batch = batch
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+
+class Notifier:
+    # One worker drains a priority heap. Telegram allows about 30 messages a second
+    # overall and one a second per chat, so a job waits while its chat is cooling
+    # down and the next eligible job goes instead. Batchable texts queued for the
+    # same chat are merged into one message when they go out.
+    def __init__(self, global_rate=25, chat_interval=1.0, max_retries=3, max_inflight=10):
+        self.global_interval = 1.0 / global_rate
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.max_inflight = max_inflight
+        self.bot = None
+        self.heap = []
+        self.delayed = []
+        self.counter = itertools.count()
+        self.chat_ready = {}
+        self.next_send = 0.0
+        self.paused_until = 0.0
+        self.inflight = set()
+        self.task = None
+        self.wakeup = None
+
+    def backlog(self):
+        counts = {(name,): 0 for name in PRIORITY_NAMES.values()}
+        for _, _, job in self.heap:
+            counts[(PRIORITY_NAMES[job.priority],)] += 1
+        counts[("delayed",)] = len(self.delayed)
+        return counts
+
+    def _push(self, job):
+        heapq.heappush(self.heap, (job.priority, next(self.counter), job))
+        if self.wakeup:
+            self.wakeup.set()
+
+    def call(self, method, chat_id, priority=NORMAL, delay=0, batch=False, **kwargs):
+        # Returns a future with the Bot API result; callers that don't care can ignore it.
+        future = asyncio.get_running_loop().create_future()
+        job = Job(priority, chat_id, method, kwargs, batch, future)
+        if delay:
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.counter), job))
+            if self.wakeup:
+                self.wakeup.set()
+        else:
+            self._push(job)
+        return future
+
+    def send(self, chat_id, text, priority=NORMAL, batch=False, **kwargs):
+        return self.call("send_message", chat_id, priority=priority, batch=batch, text=text, **kwargs)
+
+    def start(self, bot):
+        self.bot = bot
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        for task in list(self.inflight):
+            task.cancel()
+
+    def _next_job(self, now):
+        # Highest priority job whose chat may be messaged now; the rest go back on the heap.
+        skipped = []
+        job = None
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if self.chat_ready.get(entry[2].chat_id, 0) <= now:
+                job = entry[2]
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+        return job
+
+    def _merge(self, job):
+        # Fold later batchable texts for the same chat into this one. The jobs keep
+        # their own text so they can be requeued separately if the send fails.
+        if not (job.batch and job.method == "send_message"):
+            return job.kwargs, [job]
+        merged = [job]
+        length = len(job.kwargs["text"])
+        rest = []
+        for entry in self.heap:
+            other = entry[2]
+            if (other.batch and other.method == "send_message" and other.chat_id == job.chat_id
+                    and other.kwargs.keys() == job.kwargs.keys()
+                    and length + len(other.kwargs["text"]) + 2 <= MAX_TEXT_LENGTH):
+                merged.append(other)
+                length += len(other.kwargs["text"]) + 2
+            else:
+                rest.append(entry)
+        if len(merged) == 1:
+            return job.kwargs, merged
+        self.heap = rest
+        heapq.heapify(self.heap)
+        return dict(job.kwargs, text="\n\n".join(part.kwargs["text"] for part in merged)), merged
+
+    def _wait_time(self, now):
+        times = []
+        if self.heap and len(self.inflight) < self.max_inflight:
+            chat_ready = min(self.chat_ready.get(entry[2].chat_id, 0) for entry in self.heap)
+            times.append(max(self.next_send, self.paused_until, chat_ready))
+        if self.delayed:
+            times.append(self.delayed[0][0])
+        return max(0.0, min(times) - now) if times else None
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            while self.delayed and self.delayed[0][0] <= now:
+                self._push(heapq.heappop(self.delayed)[2])
+
+            job = None
+            if now >= max(self.next_send, self.paused_until) and len(self.inflight) < self.max_inflight:
+                job = self._next_job(now)
+            if job is not None:
+                kwargs, jobs = self._merge(job)
+                self.next_send = now + self.global_interval
+                self.chat_ready[job.chat_id] = now + self.chat_interval
+                if len(self.chat_ready) > 10000:
+                    self.chat_ready = {chat_id: ready for chat_id, ready in self.chat_ready.items() if ready > now}
+                task = asyncio.create_task(self._send(job, kwargs, jobs))
+                self.inflight.add(task)
+                task.add_done_callback(self._sent)
+                continue
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self._wait_time(now))
+            except asyncio.TimeoutError:
+                pass
+
+    def _sent(self, task):
+        self.inflight.discard(task)
+        if self.wakeup:
+            self.wakeup.set()
+
+    async def _send(self, job, kwargs, jobs):
+        priority = PRIORITY_NAMES[job.priority]
+        for part in jobs:
+            part.attempts += 1
+        try:
+            result = await getattr(self.bot, job.method)(chat_id=job.chat_id, **kwargs)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+            flood_waits.inc()
+            logger.warning(f"Telegram flood control, pausing notifications for {delay}s")
+            self.paused_until = time.monotonic() + delay
+            self._requeue(jobs)
+            return
+        except (Forbidden, BadRequest) as e:
+            # Blocked bot, deleted chat, message already gone: retrying won't help.
+            self._fail(jobs, priority, type(e).__name__, e)
+            return
+        except NetworkError as e:
+            if job.attempts <= self.max_retries:
+                self.chat_ready[job.chat_id] = time.monotonic() + self.chat_interval * 2 ** job.attempts
+                self._requeue(jobs)
+                return
+            self._fail(jobs, priority, type(e).__name__, e)
+            return
+        except Exception as e:
+            self._fail(jobs, priority, type(e).__name__, e)
+            return
+        sent_total.inc(priority=priority, method=job.method)
+        for part in jobs:
+            queue_wait.observe(time.monotonic() - part.queued_at, priority=PRIORITY_NAMES[part.priority])
+            if not part.future.done():
+                part.future.set_result(result)
+
+    def _requeue(self, jobs):
+        for part in jobs:
+            self._push(part)
+
+    def _fail(self, jobs, priority, reason, error):
+        failed_total.inc(len(jobs), priority=priority, reason=reason)
+        logger.warning(f"Dropping {jobs[0].method} to {jobs[0].chat_id} after {jobs[0].attempts} attempts: {error}")
+        for part in jobs:
+            if not part.future.done():
+                part.future.set_exception(error)
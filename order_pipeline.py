@@ -0,0 +1,185 @@
+# order_pipeline.py (idempotent order processing backed by a write-ahead log)
+import json
+import logging
+import os
+import threading
+import time
+from executor import run_blocking
+from log_setup import log_context
+
+logger = logging.getLogger(__name__)
+
+STARTED = "STARTED"
+CHARGING = "CHARGING"
+CHARGED = "CHARGED"
+SAVED = "SAVED"
+DONE = "DONE"
+CHARGE_FAILED = "CHARGE_FAILED"
+NEEDS_REVIEW = "NEEDS_REVIEW"
+# The charge was refused before it left (open circuit), so it can safely be sent again.
+NOT_SENT = "NOT_SENT"
+
+FINAL_STEPS = (DONE, CHARGE_FAILED)
+
+
+class OrderLog:
+    # One NDJSON line per step: {"key": invoice_id, "step": ..., "ts": ...}.
+    # The STARTED line also carries the order and what to charge for it.
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write; everything before it is intact.
+                        logger.warning(f"Skipping unreadable line in {self.path}")
+                        continue
+                    self._apply(record)
+        except FileNotFoundError:
+            pass
+        self.compact()
+        return self.entries
+
+    def _apply(self, record):
+        entry = self.entries.setdefault(record["key"], {})
+        entry["step"] = record["step"]
+        for field in ("order", "customer_id", "amount", "message"):
+            if field in record:
+                entry[field] = record[field]
+
+    def record(self, key, step, **data):
+        record = {"key": key, "step": step, "ts": time.time(), **data}
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(record)
+
+    def compact(self):
+        # Finished orders live in the order store; only unfinished ones stay in the log.
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for key, entry in self.entries.items():
+                    if entry["step"] in FINAL_STEPS:
+                        continue
+                    started = {"key": key, "step": STARTED, "ts": time.time()}
+                    started.update({field: entry[field] for field in ("order", "customer_id", "amount") if field in entry})
+                    f.write(json.dumps(started) + "\n")
+                    if entry["step"] != STARTED:
+                        f.write(json.dumps({"key": key, "step": entry["step"], "ts": time.time()}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.entries = {key: entry for key, entry in self.entries.items() if entry["step"] not in FINAL_STEPS}
+
+    def step(self, key):
+        entry = self.entries.get(key)
+        return entry["step"] if entry else None
+
+
+class OrderPipeline:
+    # STARTED -> CHARGING -> CHARGED -> SAVED -> DONE, keyed by invoice_id.
+    # charge(customer_id, amount) returns (message, status) like remove_balance_to_user:
+    # status None means no answer, NOT_SENT that the request never went out.
+    # save(order) persists the order and enqueue(order) puts it in the delivery queue.
+    # notify(order, ok, message) hears how an order resumed by recover() ended.
+    # Log writes are fsynced, so they run on the blocking executor.
+    def __init__(self, log, charge, save, enqueue, is_saved, notify=None):
+        self.log = log
+        self.charge = charge
+        self.save = save
+        self.enqueue = enqueue
+        self.is_saved = is_saved
+        self.notify = notify
+        self.running = set()
+
+    def retrying(self, key):
+        # The charge wasn't sent; recover() will try it again.
+        return self.log.step(key) == NOT_SENT
+
+    async def run(self, key, order, customer_id, amount):
+        if key in self.running:
+            return False, "Order is already being processed."
+        self.running.add(key)
+        try:
+            with log_context(invoice_id=key):
+                step = self.log.step(key)
+                if step is None and await run_blocking("store", self.is_saved, key):
+                    return True, "Order was already processed."
+                if step in (DONE, SAVED):
+                    return True, "Order was already processed."
+                if step in (CHARGE_FAILED, NEEDS_REVIEW):
+                    return False, f"Order is {step}."
+                if step is None:
+                    await self._record(key, STARTED, order=order, customer_id=customer_id, amount=amount)
+                return await self._advance(key)
+        finally:
+            self.running.discard(key)
+
+    async def _record(self, key, step, **data):
+        await run_blocking("orders", self.log.record, key, step, **data)
+
+    async def _advance(self, key):
+        while True:
+            entry = self.log.entries[key]
+            step = entry["step"]
+            if step in (STARTED, NOT_SENT):
+                await self._record(key, CHARGING)
+                message, status = await self.charge(entry["customer_id"], entry["amount"])
+                if status == 200:
+                    await self._record(key, CHARGED, message=message)
+                elif status == NOT_SENT:
+                    await self._record(key, NOT_SENT, message=message)
+                    return False, message
+                elif status is None:
+                    # No answer from Sellpass: the balance may or may not have been taken.
+                    await self._record(key, NEEDS_REVIEW, message=message)
+                else:
+                    await self._record(key, CHARGE_FAILED, message=message)
+            elif step == CHARGED:
+                await self.save(entry["order"])
+                await self._record(key, SAVED)
+            elif step == SAVED:
+                self.enqueue(entry["order"])
+                await self._record(key, DONE)
+            elif step == DONE:
+                return True, entry.get("message", "Order processed.")
+            else:
+                return False, entry.get("message", step)
+
+    async def recover(self):
+        # Runs at startup and then periodically to retry charges that weren't sent.
+        resumed = 0
+        for key, entry in list(self.log.entries.items()):
+            if key in self.running:
+                continue
+            if entry["step"] == CHARGING:
+                # Crashed while the charge was in flight; charging again could bill twice.
+                logger.error(f"Order {key} was interrupted while charging {entry.get('customer_id')} ${entry.get('amount')}. Needs manual review.")
+                await self._record(key, NEEDS_REVIEW, message="Interrupted while charging")
+            elif entry["step"] in (STARTED, NOT_SENT, CHARGED, SAVED):
+                resumed += 1
+                self.running.add(key)
+                try:
+                    with log_context(invoice_id=key):
+                        ok, message = await self._advance(key)
+                finally:
+                    self.running.discard(key)
+                if self.log.step(key) == NOT_SENT:
+                    logger.info(f"Order {key} still waiting for its charge to be sent: {message}")
+                    continue
+                logger.info(f"Recovered order {key}: {message}")
+                if self.notify:
+                    self.notify(entry["order"], ok, message)
+        return resumed
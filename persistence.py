@@ -0,0 +1,164 @@
+# persistence.py (user_data kept in SQLite so restarts don't drop in-flight flows)
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from telegram.ext import BasePersistence, PersistenceInput
+from executor import run_blocking
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+flushes = registry.counter("bot_user_state_flushes_total", "Batched writes of changed user data.")
+rows_written = registry.counter("bot_user_state_rows_written_total", "User data rows written or deleted.")
+
+
+class SqlitePersistence(BasePersistence):
+    # One row per user holding their user_data as JSON. The application hands us
+    # every user touched since its last persistence run; users whose data didn't
+    # change are skipped and the rest are written in a single transaction.
+    # Chat data, bot data, callback data and conversations aren't used here.
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS user_data (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_user_data_updated ON user_data (updated);
+    """
+
+    def __init__(self, path, update_interval, max_age):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.path = path
+        self.max_age = max_age
+        self.conn = None
+        self.saved = {}
+        self.pending = {}
+        self.flush_task = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+        return conn
+
+    def _load(self):
+        # Flows abandoned longer than max_age are dropped instead of resumed.
+        if self.conn is None:
+            self.conn = self._connect()
+        with self.conn:
+            self.conn.execute("DELETE FROM user_data WHERE updated < ?", (time.time() - self.max_age,))
+        return self.conn.execute("SELECT user_id, data FROM user_data").fetchall()
+
+    def _write(self, batch):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO user_data (user_id, data, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+                [(user_id, data, now) for user_id, data in batch.items() if data is not None]
+            )
+            self.conn.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(user_id,) for user_id, data in batch.items() if data is None]
+            )
+
+    async def get_user_data(self):
+        started = time.perf_counter()
+        rows = await run_blocking("state", self._load)
+        user_data = {}
+        for user_id, data in rows:
+            self.saved[user_id] = data
+            user_data[user_id] = json.loads(data)
+        logger.info(f"Restored user data for {len(user_data)} users in {time.perf_counter() - started:.3f}s")
+        return user_data
+
+    async def update_user_data(self, user_id, data):
+        if not data:
+            await self.drop_user_data(user_id)
+            return
+        try:
+            encoded = json.dumps(data, sort_keys=True)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Not persisting user data for {user_id}: {e}")
+            return
+        if self.saved.get(user_id) == encoded:
+            return
+        self.saved[user_id] = encoded
+        self.pending[user_id] = encoded
+        self._schedule()
+
+    async def drop_user_data(self, user_id):
+        if self.saved.pop(user_id, None) is None:
+            return
+        self.pending[user_id] = None
+        self._schedule()
+
+    def _schedule(self):
+        # Every update_user_data call of one persistence run lands in the same batch.
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_pending())
+
+    async def _flush_pending(self):
+        while self.pending:
+            batch, self.pending = self.pending, {}
+            try:
+                await run_blocking("state", self._write, batch)
+            except sqlite3.Error as e:
+                logger.error(f"Writing user data for {len(batch)} users failed: {e}")
+                # Put the batch back behind anything newer; the next run retries it.
+                for user_id, data in batch.items():
+                    self.pending.setdefault(user_id, data)
+                return
+            flushes.inc()
+            rows_written.inc(len(batch))
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def flush(self):
+        if self.flush_task:
+            await self.flush_task
+        await self._flush_pending()
+        if self.conn is not None:
+            await run_blocking("state", self.conn.close)
+            self.conn = None
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
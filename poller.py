@@ -0,0 +1,127 @@
+# poller.py (single scheduler for pending invoice status checks)
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from log_setup import log_context
+
+logger = logging.getLogger(__name__)
+
+
+class InvoicePoller:
+    # check(invoice_id, hoodpay_id) returns True once the invoice reached a final state.
+    # Hoodpay decides when an invoice expires, so one still open after `expiry`
+    # seconds keeps being checked every max_interval to catch a late payment.
+    # Only after `give_up` seconds is expire(invoice_id) called and polling stopped.
+    def __init__(self, check, expire, concurrency, expiry, give_up, min_interval, max_interval, backoff):
+        self.check = check
+        self.expire = expire
+        self.concurrency = concurrency
+        self.expiry = expiry
+        self.give_up = give_up
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.heap = []
+        self.pending = {}
+        self.inflight = set()
+        self.counter = itertools.count()
+        self.wakeup = None
+        self.task = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def interval(self, age):
+        # Fresh invoices are checked often, older ones progressively less.
+        return min(self.max_interval, max(self.min_interval, age * self.backoff))
+
+    def next_check(self, created_at):
+        now = time.time()
+        age = now - created_at
+        interval = self.max_interval if age >= self.expiry else self.interval(age)
+        return min(now + interval, created_at + self.give_up)
+
+    def add(self, invoice_id, hoodpay_id, created_at=None):
+        if invoice_id in self.pending:
+            return
+        created_at = created_at or time.time()
+        self.pending[invoice_id] = (hoodpay_id, created_at)
+        self._schedule(invoice_id, self.next_check(created_at))
+        self.start()
+
+    def discard(self, invoice_id):
+        # Heap entries of discarded invoices are skipped when they come due.
+        self.pending.pop(invoice_id, None)
+
+    def _schedule(self, invoice_id, when):
+        heapq.heappush(self.heap, (when, next(self.counter), invoice_id))
+        if self.wakeup:
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now and len(self.inflight) < self.concurrency:
+                _, _, invoice_id = heapq.heappop(self.heap)
+                if invoice_id in self.pending and invoice_id not in self.inflight:
+                    self.inflight.add(invoice_id)
+                    asyncio.create_task(self._check(invoice_id))
+
+            timeout = None
+            if self.heap and len(self.inflight) < self.concurrency:
+                timeout = max(0, self.heap[0][0] - now)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _check(self, invoice_id):
+        entry = self.pending.get(invoice_id)
+        if entry is None:
+            # Discarded after it was picked from the heap.
+            self.inflight.discard(invoice_id)
+            self.wakeup.set()
+            return
+        hoodpay_id, created_at = entry
+        with log_context(invoice_id=invoice_id, hoodpay_id=hoodpay_id):
+            await self._check_one(invoice_id, hoodpay_id, created_at)
+
+    async def _check_one(self, invoice_id, hoodpay_id, created_at):
+        done = False
+        try:
+            done = await self.check(invoice_id, hoodpay_id)
+        except Exception:
+            logger.exception(f"Status check for invoice {invoice_id} failed")
+        finally:
+            self.inflight.discard(invoice_id)
+
+        if invoice_id in self.pending:
+            if done:
+                self.pending.pop(invoice_id)
+            elif time.time() >= created_at + self.give_up:
+                self.pending.pop(invoice_id)
+                logger.warning(f"Invoice {invoice_id} still open after {self.give_up:.0f}s. Expiring it.")
+                try:
+                    await self.expire(invoice_id)
+                except Exception:
+                    logger.exception(f"Failed to expire invoice {invoice_id}")
+            else:
+                self._schedule(invoice_id, self.next_check(created_at))
+        self.wakeup.set()
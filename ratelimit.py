@@ -0,0 +1,149 @@
+# ratelimit.py (per-user token buckets and per-upstream concurrency caps)
+import asyncio
+import contextlib
+import logging
+import math
+import time
+from config import *
+from metrics import registry
+from circuit import breakers
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "⏳ Busy, please retry in {seconds} s."
+UNAVAILABLE_MESSAGE = "⚠️ The shop is not responding right now. Please retry in {seconds} s."
+
+rejected = registry.counter("bot_admission_rejected_total", "Requests turned away before reaching an upstream.", ("command", "reason"))
+admitted = registry.counter("bot_admission_admitted_total", "Requests let through admission control.", ("command",))
+
+
+def parse_limits(spec, parse):
+    # "name=value,name=value" -> {name: parse(value)}
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        limits[name.strip()] = parse(value.strip())
+    return limits
+
+
+def parse_rate(value):
+    # "5/30" -> (burst 5, refilled over 30 seconds)
+    burst, _, period = value.partition("/")
+    return int(burst), float(period)
+
+
+class UserLimiter:
+    # One token bucket per (user, command): `burst` requests may go back to back,
+    # then one more every period / burst seconds.
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}
+        self.checks = 0
+
+    def check(self, user_id, command):
+        # Takes a token and returns 0, or returns the seconds until one is free.
+        limit = self.limits.get(command)
+        if limit is None:
+            return 0
+        burst, period = limit
+        rate = burst / period
+        now = time.monotonic()
+        key = (user_id, command)
+        tokens, updated = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        self.checks += 1
+        if self.checks % 1000 == 0:
+            self.prune(now)
+        if tokens < 1:
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+        self.buckets[key] = (tokens - 1, now)
+        return 0
+
+    def prune(self, now):
+        # A bucket untouched for a whole period is full again, the same as no bucket.
+        self.buckets = {
+            key: (tokens, updated) for key, (tokens, updated) in self.buckets.items()
+            if now - updated < self.limits[key[1]][1]
+        }
+
+
+class UpstreamLimiter:
+    # Caps concurrent calls per upstream. Background work waits for a slot;
+    # user requests are turned away by admit() while the upstream is full.
+    def __init__(self, limits):
+        self.limits = limits
+        self.semaphores = {}
+        self.active = {upstream: 0 for upstream in limits}
+        self.waiting = {upstream: 0 for upstream in limits}
+
+    def busy(self, upstream):
+        limit = self.limits.get(upstream)
+        return limit is not None and self.active[upstream] + self.waiting[upstream] >= limit
+
+    @contextlib.asynccontextmanager
+    async def slot(self, upstream):
+        limit = self.limits.get(upstream)
+        if limit is None:
+            yield
+            return
+        semaphore = self.semaphores.get(upstream)
+        if semaphore is None:
+            semaphore = self.semaphores[upstream] = asyncio.Semaphore(limit)
+        self.waiting[upstream] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting[upstream] -= 1
+        self.active[upstream] += 1
+        try:
+            yield
+        finally:
+            self.active[upstream] -= 1
+            semaphore.release()
+
+
+user_limiter = UserLimiter(parse_limits(RATE_LIMITS, parse_rate))
+upstream_limiter = UpstreamLimiter(parse_limits(UPSTREAM_CONCURRENCY, int))
+
+registry.gauge("bot_rate_limit_burst", "Configured requests per user allowed back to back.", ("command",),
+               callback=lambda: {(command,): burst for command, (burst, _) in user_limiter.limits.items()})
+registry.gauge("bot_rate_limit_period_seconds", "Configured time for a user's bucket to refill.", ("command",),
+               callback=lambda: {(command,): period for command, (_, period) in user_limiter.limits.items()})
+registry.gauge("bot_rate_limit_buckets", "Per-user buckets currently tracked.", callback=lambda: len(user_limiter.buckets))
+registry.gauge("bot_upstream_concurrency_limit", "Configured concurrent calls per upstream.", ("upstream",),
+               callback=lambda: {(upstream,): limit for upstream, limit in upstream_limiter.limits.items()})
+registry.gauge("bot_upstream_active", "Upstream calls in flight.", ("upstream",),
+               callback=lambda: {(upstream,): count for upstream, count in upstream_limiter.active.items()})
+registry.gauge("bot_upstream_waiting", "Upstream calls waiting for a free slot.", ("upstream",),
+               callback=lambda: {(upstream,): count for upstream, count in upstream_limiter.waiting.items()})
+
+
+async def admit(update, command, upstreams=()):
+    # Called before a handler does upstream work. A rejected request (open circuit,
+    # saturated upstream or empty bucket) gets a short reply or callback answer
+    # and never touches the network.
+    message = BUSY_MESSAGE
+    retry_after = max((breakers.retry_after(upstream) for upstream in upstreams), default=0)
+    if retry_after:
+        reason = "circuit"
+        message = UNAVAILABLE_MESSAGE
+    elif any(upstream_limiter.busy(upstream) for upstream in upstreams):
+        reason = "upstream"
+        retry_after = UPSTREAM_BUSY_RETRY
+    else:
+        reason = "user"
+        retry_after = user_limiter.check(update.effective_user.id, command)
+    if not retry_after:
+        admitted.inc(command=command)
+        return True
+
+    rejected.inc(command=command, reason=reason)
+    logger.info(f"Rejected {command} for user {update.effective_user.id} ({reason}), retry in {retry_after:.1f}s",
+                extra={"sample": f"admission_{reason}"})
+    text = message.format(seconds=math.ceil(retry_after))
+    if update.callback_query:
+        await update.callback_query.answer(text)
+    else:
+        await update.effective_message.reply_text(text)
+    return False
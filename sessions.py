@@ -0,0 +1,109 @@
+# sessions.py (in-memory index over the session file)
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    # The session file is append-only: a line is either a session record as
+    # written by save_user_data, or {"user_id": ..., "removed": true} dropping
+    # every session of that user. Reads never touch the disk.
+    def __init__(self, path):
+        self.path = path
+        self.sessions = {}
+        self.heap = []
+        self.lines = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            self.sessions.clear()
+            self.heap.clear()
+            self.lines = 0
+            try:
+                with open(self.path, "r") as file:
+                    for line in file:
+                        if not line.strip():
+                            continue
+                        self.lines += 1
+                        record = json.loads(line)
+                        if record.get("removed"):
+                            self.sessions.pop(record["user_id"], None)
+                        else:
+                            self._index(record)
+            except FileNotFoundError:
+                pass
+        self.evict_expired()
+        logger.info(f"Loaded {self.live()} sessions from {self.path}")
+
+    def _index(self, record):
+        self.sessions.setdefault(record["user_id"], []).append(record)
+        heapq.heappush(self.heap, (record["expiry_raw"], record["user_id"], record["token"]))
+
+    def _append(self, record):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a") as file:
+            file.write(json.dumps(record) + "\n")
+        self.lines += 1
+
+    def add(self, record):
+        with self.lock:
+            self._append(record)
+            self._index(record)
+
+    def remove_user(self, user_id):
+        with self.lock:
+            if self.sessions.pop(user_id, None) is None:
+                return False
+            self._append({"user_id": user_id, "removed": True})
+            return True
+
+    def get(self, user_id):
+        self.evict_expired()
+        return list(self.sessions.get(user_id, []))
+
+    def evict_expired(self, now=None):
+        now = now or time.time()
+        removed = 0
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, user_id, token = heapq.heappop(self.heap)
+                sessions = self.sessions.get(user_id)
+                if not sessions:
+                    continue
+                remaining = [session for session in sessions if session["token"] != token]
+                if len(remaining) == len(sessions):
+                    continue
+                removed += len(sessions) - len(remaining)
+                logger.info(f"Token expired for {sessions[0]['email']}, removing.")
+                if remaining:
+                    self.sessions[user_id] = remaining
+                else:
+                    del self.sessions[user_id]
+        return removed
+
+    def dead(self):
+        return self.lines - self.live()
+
+    def compact(self):
+        # Rewrite the file with only the live sessions, then swap it in atomically.
+        with self.lock:
+            records = [session for sessions in self.sessions.values() for session in sessions]
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                for record in records:
+                    file.write(json.dumps(record) + "\n")
+            os.replace(tmp_path, self.path)
+            self.lines = len(records)
+            self.heap = [(record["expiry_raw"], record["user_id"], record["token"]) for record in records]
+            heapq.heapify(self.heap)
+
+    def live(self):
+        return sum(len(sessions) for sessions in self.sessions.values())
@@ -0,0 +1,426 @@
+# storage.py (order / invoice store)
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class JsonStore:
+    # Legacy layout: one JSON array per file, rewritten on every change.
+    def __init__(self, order_file, invoice_file):
+        self.order_file = order_file
+        self.invoice_file = invoice_file
+        self.lock = threading.Lock()
+
+    def _load(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r') as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return []
+
+    def _dump(self, path, records):
+        with open(path, 'w') as f:
+            json.dump(records, f, indent=4)
+
+    def add_order(self, order):
+        with self.lock:
+            orders = self._load(self.order_file)
+            orders.append(order)
+            self._dump(self.order_file, orders)
+
+    def add_invoice(self, invoice):
+        with self.lock:
+            invoices = self._load(self.invoice_file)
+            invoices.append(invoice)
+            self._dump(self.invoice_file, invoices)
+
+    def get_invoice(self, invoice_id):
+        for invoice in self._load(self.invoice_file):
+            if invoice['invoice_id'] == invoice_id:
+                return invoice
+        return None
+
+    def get_invoice_by_hoodpay_id(self, hoodpay_id):
+        for invoice in self._load(self.invoice_file):
+            if invoice['hoodpay_id'] == hoodpay_id:
+                return invoice
+        return None
+
+    def set_invoice_status(self, invoice_id, status, expected=None):
+        # With `expected`, only an invoice currently in that status is changed.
+        with self.lock:
+            invoices = self._load(self.invoice_file)
+            found = False
+            for invoice in invoices:
+                if invoice['invoice_id'] == invoice_id and expected in (None, invoice['status']):
+                    invoice['status'] = status
+                    found = True
+            if found:
+                self._dump(self.invoice_file, invoices)
+            return found
+
+    def invoices_by_status(self, status):
+        return [invoice for invoice in self._load(self.invoice_file) if invoice['status'] == status]
+
+    def mark_delivered(self, invoice_ids):
+        invoice_ids = set(invoice_ids)
+        with self.lock:
+            orders = self._load(self.order_file)
+            updated = 0
+            for order in orders:
+                if order['invoice_id'] in invoice_ids and not order['delivered']:
+                    order['delivered'] = True
+                    updated += 1
+            if updated:
+                self._dump(self.order_file, orders)
+            return updated
+
+    def undelivered_orders(self):
+        return [order for order in self._load(self.order_file) if not order['delivered']]
+
+    def has_order(self, invoice_id):
+        return any(order['invoice_id'] == invoice_id for order in self._load(self.order_file))
+
+    def counts(self):
+        return len(self._load(self.order_file)), len(self._load(self.invoice_file))
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    # Each record is kept as a JSON blob; the columns we filter on are
+    # duplicated next to it so they can be indexed and updated in place.
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS orders (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id TEXT NOT NULL UNIQUE,
+        user_id INTEGER,
+        variant_id TEXT,
+        delivered INTEGER NOT NULL DEFAULT 0,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_orders_delivered ON orders (delivered);
+    CREATE TABLE IF NOT EXISTS invoices (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id TEXT NOT NULL UNIQUE,
+        user_id INTEGER,
+        hoodpay_id TEXT,
+        status TEXT NOT NULL,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices (status);
+    CREATE INDEX IF NOT EXISTS idx_invoices_hoodpay_id ON invoices (hoodpay_id);
+    DROP INDEX IF EXISTS idx_orders_user_id;
+    DROP INDEX IF EXISTS idx_invoices_user_id;
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _order_from_row(self, row):
+        order = json.loads(row[0])
+        order['delivered'] = bool(row[1])
+        return order
+
+    def _invoice_from_row(self, row):
+        invoice = json.loads(row[0])
+        invoice['status'] = row[1]
+        return invoice
+
+    def add_order(self, order):
+        self._execute(
+            "INSERT INTO orders (invoice_id, user_id, variant_id, delivered, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(invoice_id) DO NOTHING",
+            (order['invoice_id'], order['user_id'], order['variant_id'], int(bool(order['delivered'])), json.dumps(order))
+        )
+
+    def add_invoice(self, invoice):
+        self._execute(
+            "INSERT INTO invoices (invoice_id, user_id, hoodpay_id, status, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(invoice_id) DO NOTHING",
+            (invoice['invoice_id'], invoice['user_id'], invoice['hoodpay_id'], invoice['status'], json.dumps(invoice))
+        )
+
+    def get_invoice(self, invoice_id):
+        rows = self._query("SELECT data, status FROM invoices WHERE invoice_id = ?", (invoice_id,))
+        return self._invoice_from_row(rows[0]) if rows else None
+
+    def get_invoice_by_hoodpay_id(self, hoodpay_id):
+        rows = self._query("SELECT data, status FROM invoices WHERE hoodpay_id = ? ORDER BY seq DESC LIMIT 1", (hoodpay_id,))
+        return self._invoice_from_row(rows[0]) if rows else None
+
+    def set_invoice_status(self, invoice_id, status, expected=None):
+        if expected is None:
+            cursor = self._execute("UPDATE invoices SET status = ? WHERE invoice_id = ?", (status, invoice_id))
+        else:
+            cursor = self._execute("UPDATE invoices SET status = ? WHERE invoice_id = ? AND status = ?", (status, invoice_id, expected))
+        return cursor.rowcount > 0
+
+    def invoices_by_status(self, status):
+        rows = self._query("SELECT data, status FROM invoices WHERE status = ? ORDER BY seq", (status,))
+        return [self._invoice_from_row(row) for row in rows]
+
+    def has_order(self, invoice_id):
+        return bool(self._query("SELECT 1 FROM orders WHERE invoice_id = ?", (invoice_id,)))
+
+    def mark_delivered(self, invoice_ids):
+        # The data blob keeps its old flag; _order_from_row always reads the column.
+        with self.lock, self.conn:
+            cursor = self.conn.executemany(
+                "UPDATE orders SET delivered = 1 WHERE invoice_id = ? AND delivered = 0",
+                [(invoice_id,) for invoice_id in invoice_ids]
+            )
+            return cursor.rowcount
+
+    def undelivered_orders(self):
+        rows = self._query("SELECT data, delivered FROM orders WHERE delivered = 0 ORDER BY seq")
+        return [self._order_from_row(row) for row in rows]
+
+    def counts(self):
+        orders = self._query("SELECT COUNT(*) FROM orders")[0][0]
+        invoices = self._query("SELECT COUNT(*) FROM invoices")[0][0]
+        return orders, invoices
+
+    def import_records(self, orders, invoices):
+        # Bulk load in a single transaction; used by the JSON importer.
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO orders (invoice_id, user_id, variant_id, delivered, data) VALUES (?, ?, ?, ?, ?)",
+                [(o['invoice_id'], o['user_id'], o['variant_id'], int(bool(o['delivered'])), json.dumps(o)) for o in orders]
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO invoices (invoice_id, user_id, hoodpay_id, status, data) VALUES (?, ?, ?, ?, ?)",
+                [(i['invoice_id'], i['user_id'], i['hoodpay_id'], i['status'], json.dumps(i)) for i in invoices]
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class Journal:
+    # Newline-delimited JSON, one change per line: {"put": record} stores a whole
+    # record, {"key": ..., "set": {...}} updates fields of one already stored.
+    # The current state is rebuilt in memory on load; compact() rewrites the file
+    # as one put per live record.
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.records = {}
+        self.lines = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            self.records = {}
+            self.lines = 0
+            try:
+                with open(self.path, 'r') as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # A torn last line from a crash mid-write.
+                            logger.warning(f"Skipping unreadable line in {self.path}")
+                            continue
+                        self.lines += 1
+                        self._apply(entry)
+            except FileNotFoundError:
+                pass
+        return self.records
+
+    def _apply(self, entry):
+        if 'put' in entry:
+            record = entry['put']
+            self.records[record[self.key]] = record
+        elif entry.get('key') in self.records:
+            self.records[entry['key']].update(entry['set'])
+
+    def _append(self, entries):
+        with open(self.path, 'a') as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        self.lines += len(entries)
+        for entry in entries:
+            self._apply(entry)
+
+    def put(self, record):
+        with self.lock:
+            self._append([{'put': dict(record)}])
+
+    def put_many(self, records):
+        with self.lock:
+            self._append([{'put': dict(record)} for record in records])
+
+    def set(self, key, expect=None, **fields):
+        # expect: fields the record must currently have for the change to be made.
+        with self.lock:
+            record = self.records.get(key)
+            if record is None or any(record.get(name) != value for name, value in (expect or {}).items()):
+                return False
+            self._append([{'key': key, 'set': fields}])
+            return True
+
+    def set_many(self, keys, **fields):
+        with self.lock:
+            entries = [{'key': key, 'set': fields} for key in keys if key in self.records]
+            self._append(entries)
+            return len(entries)
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def values(self):
+        return list(self.records.values())
+
+    def dead(self):
+        return self.lines - len(self.records)
+
+    def compact(self):
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                for record in self.records.values():
+                    f.write(json.dumps({'put': record}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.lines = len(self.records)
+
+
+class JournalStore:
+    # Orders and invoices each get their own journal, so an order save or a
+    # status change is a single line appended instead of a full rewrite.
+    def __init__(self, order_journal, invoice_journal):
+        self.orders = Journal(order_journal, 'invoice_id')
+        self.invoices = Journal(invoice_journal, 'invoice_id')
+        self.orders.load()
+        self.invoices.load()
+        self.by_hoodpay_id = {}
+        for invoice in self.invoices.values():
+            self.by_hoodpay_id[invoice['hoodpay_id']] = invoice['invoice_id']
+
+    def add_order(self, order):
+        self.orders.put(order)
+
+    def add_invoice(self, invoice):
+        self.invoices.put(invoice)
+        self.by_hoodpay_id[invoice['hoodpay_id']] = invoice['invoice_id']
+
+    def get_invoice(self, invoice_id):
+        invoice = self.invoices.get(invoice_id)
+        return dict(invoice) if invoice else None
+
+    def get_invoice_by_hoodpay_id(self, hoodpay_id):
+        invoice_id = self.by_hoodpay_id.get(hoodpay_id)
+        return self.get_invoice(invoice_id) if invoice_id else None
+
+    def set_invoice_status(self, invoice_id, status, expected=None):
+        return self.invoices.set(invoice_id, expect=expected and {'status': expected}, status=status)
+
+    def invoices_by_status(self, status):
+        return [dict(invoice) for invoice in self.invoices.values() if invoice['status'] == status]
+
+    def has_order(self, invoice_id):
+        return self.orders.get(invoice_id) is not None
+
+    def mark_delivered(self, invoice_ids):
+        orders = self.orders.records
+        # dict.fromkeys drops repeated ids, so each order is written and counted once.
+        pending = [invoice_id for invoice_id in dict.fromkeys(invoice_ids) if invoice_id in orders and not orders[invoice_id]['delivered']]
+        return self.orders.set_many(pending, delivered=True)
+
+    def undelivered_orders(self):
+        return [dict(order) for order in self.orders.values() if not order['delivered']]
+
+    def counts(self):
+        return len(self.orders.records), len(self.invoices.records)
+
+    def import_records(self, orders, invoices):
+        self.orders.put_many([o for o in orders if not self.has_order(o['invoice_id'])])
+        self.invoices.put_many([i for i in invoices if self.invoices.get(i['invoice_id']) is None])
+        for invoice in invoices:
+            self.by_hoodpay_id[invoice['hoodpay_id']] = invoice['invoice_id']
+
+    def dead(self):
+        return self.orders.dead() + self.invoices.dead()
+
+    def compact(self):
+        self.orders.compact()
+        self.invoices.compact()
+
+    def close(self):
+        pass
+
+
+def import_json(store, order_file, invoice_file):
+    legacy = JsonStore(order_file, invoice_file)
+    orders = legacy._load(order_file)
+    invoices = legacy._load(invoice_file)
+    store.import_records(orders, invoices)
+    logger.info(f"Imported {len(orders)} orders and {len(invoices)} invoices from {order_file} / {invoice_file}")
+    return len(orders), len(invoices)
+
+
+def journal_path(path):
+    return os.path.splitext(path)[0] + ".ndjson"
+
+
+def open_store(backend, path, order_file, invoice_file):
+    if backend == "json":
+        return JsonStore(order_file, invoice_file)
+    if backend == "sqlite":
+        store = SqliteStore(path)
+    elif backend == "journal":
+        store = JournalStore(journal_path(order_file), journal_path(invoice_file))
+    else:
+        raise ValueError(f"Unknown STORE_BACKEND: {backend}")
+    # First start against an empty store: bring the legacy files over once.
+    if store.counts() == (0, 0) and (os.path.exists(order_file) or os.path.exists(invoice_file)):
+        import_json(store, order_file, invoice_file)
+    return store
+
+
+if __name__ == '__main__':
+    # python storage.py [db_path] [order_file] [invoice_file]
+    # python storage.py journal [order_file] [invoice_file]
+    args = sys.argv[1:]
+    logging.basicConfig(level=logging.INFO)
+    if args and args[0] == "journal":
+        order_file = args[1] if len(args) > 1 else "preorders.json"
+        invoice_file = args[2] if len(args) > 2 else "crypto_invoices.json"
+        target = f"{journal_path(order_file)} / {journal_path(invoice_file)}"
+        store = JournalStore(journal_path(order_file), journal_path(invoice_file))
+    else:
+        db_path = args[0] if len(args) > 0 else "store.db"
+        order_file = args[1] if len(args) > 1 else "preorders.json"
+        invoice_file = args[2] if len(args) > 2 else "crypto_invoices.json"
+        target = db_path
+        store = SqliteStore(db_path)
+    orders, invoices = import_json(store, order_file, invoice_file)
+    print(f"Imported {orders} orders and {invoices} invoices into {target}")
+    store.close()
@@ -0,0 +1,23 @@
+# conftest.py (local fake upstreams for the client tests)
+import contextlib
+import os
+import sys
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@contextlib.asynccontextmanager
+async def serve(*routes):
+    # Starts an aiohttp app on a free local port and yields its base URL.
+    app = web.Application()
+    app.router.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,42 @@
+# test_cache.py (variant button tokens across a cache restart)
+import asyncio
+from cache import VariantCache
+
+VARIANTS = [
+    {"id": 725392, "title": "BUFFPAL BRUTE [MIXED]"},
+    {"id": 735730, "title": "BUFFPAL BRUTE [CH]"},
+]
+
+
+def make_cache(variants):
+    async def fetch():
+        return list(variants)
+    return VariantCache(fetch, ttl=60, stale_ttl=60)
+
+
+def test_token_resolves_after_restart():
+    token = make_cache(VARIANTS).token(VARIANTS[1])
+
+    # A fresh process: nothing loaded yet, but the button is not stale.
+    cache = make_cache(VARIANTS)
+    assert not cache.is_stale_token(token)
+    assert cache.resolve_token(token) is None
+
+    asyncio.run(cache.get())
+    assert cache.resolve_token(token)["title"] == "BUFFPAL BRUTE [CH]"
+
+
+def test_removed_variant_does_not_resolve():
+    token = make_cache(VARIANTS).token(VARIANTS[1])
+    cache = make_cache(VARIANTS[:1])
+    asyncio.run(cache.get())
+    assert not cache.is_stale_token(token)
+    assert cache.resolve_token(token) is None
+
+
+def test_malformed_tokens_are_stale():
+    cache = make_cache(VARIANTS)
+    assert cache.is_stale_token("pv:abc")
+    assert cache.is_stale_token("pv:12")
+    assert cache.is_stale_token("preordero,725392,BUFFPAL")
+    assert not cache.is_stale_token("crypto")
@@ -0,0 +1,49 @@
+# test_captcha_pool.py (pre-solved tokens only while logins ask for them)
+import asyncio
+import itertools
+from captcha_pool import CaptchaPool
+
+
+def make_pool(max_age=0.2, idle=0.3):
+    counter = itertools.count(1)
+    solves = []
+
+    async def solve():
+        await asyncio.sleep(0.01)
+        token = f"token-{next(counter)}"
+        solves.append(token)
+        return token
+
+    return CaptchaPool(solve, size=2, max_age=max_age, idle=idle), solves
+
+
+def test_no_solves_without_demand():
+    async def main():
+        pool, solves = make_pool()
+        pool.start()
+        await asyncio.sleep(0.2)
+        await pool.stop()
+        return solves
+
+    assert asyncio.run(main()) == []
+
+
+def test_refills_after_a_login_then_stops_when_idle():
+    async def main():
+        pool, solves = make_pool(max_age=0.2, idle=0.3)
+        pool.start()
+        first = await pool.checkout()
+        await asyncio.sleep(0.1)
+        ready = len(pool.tokens)
+        # Well past the idle window: stale tokens are dropped and not replaced.
+        await asyncio.sleep(0.8)
+        solves_when_idle = len(solves)
+        await asyncio.sleep(0.5)
+        await pool.stop()
+        return first, ready, solves_when_idle, len(solves), len(pool.tokens)
+
+    first, ready, solves_when_idle, solves, tokens = asyncio.run(main())
+    assert first == "token-1"
+    assert ready == 2
+    assert solves == solves_when_idle
+    assert tokens == 0
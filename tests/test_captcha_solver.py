@@ -0,0 +1,164 @@
+# test_captcha_solver.py (CaptchaClient polling against a local CapSolver fake)
+import asyncio
+import itertools
+import time
+from aiohttp import web
+from captcha_solver import CaptchaClient
+from conftest import serve
+
+
+class CapSolver:
+    # Tasks become ready `solve_time` seconds after createTask; None never solves.
+    # Polls for the task ids in `stall` hang for `stall_time` seconds.
+    def __init__(self, solve_time, fail=False, stall=(), stall_time=0.0):
+        self.solve_time = solve_time
+        self.fail = fail
+        self.stall = set(stall)
+        self.stall_time = stall_time
+        self.ready_at = {}
+        self.ids = itertools.count(1)
+        self.polls = 0
+
+    def routes(self):
+        return [web.post("/createTask", self.create), web.post("/getTaskResult", self.result)]
+
+    async def create(self, request):
+        task_id = str(next(self.ids))
+        self.ready_at[task_id] = None if self.solve_time is None else time.monotonic() + self.solve_time
+        return web.json_response({"errorId": 0, "taskId": task_id})
+
+    async def result(self, request):
+        self.polls += 1
+        task_id = (await request.json())["taskId"]
+        if task_id in self.stall:
+            await asyncio.sleep(self.stall_time)
+        if self.fail:
+            return web.json_response({"errorId": 1, "errorCode": "ERROR_CAPTCHA_UNSOLVABLE"})
+        ready_at = self.ready_at[task_id]
+        if ready_at is not None and time.monotonic() >= ready_at:
+            return web.json_response({"errorId": 0, "status": "ready", "solution": {"gRecaptchaResponse": f"token-{task_id}"}})
+        return web.json_response({"errorId": 0, "status": "processing"})
+
+
+def run_client(fake, deadline, scenario, **intervals):
+    async def main():
+        async with serve(*fake.routes()) as url:
+            client = CaptchaClient(url, "key", deadline, **intervals)
+            try:
+                return await scenario(client)
+            finally:
+                await client.close()
+    return asyncio.run(main())
+
+
+def test_intervals_follow_recent_solve_times():
+    client = CaptchaClient("http://unused", "key", 60, min_interval=1.0, max_interval=5.0, default_interval=3.0)
+    # Too few samples: the default for both.
+    client.solve_times.extend([10, 12])
+    assert client.first_poll_delay() == 3.0
+    assert client.poll_interval() == 3.0
+
+    client.solve_times.clear()
+    client.solve_times.extend([8, 10, 12, 14, 16, 18, 20, 22])
+    assert client.first_poll_delay() == 12
+    # (p90 22 - p25 12) / 5
+    assert client.poll_interval() == 2.0
+
+    # Clamped to the configured range.
+    client.solve_times.clear()
+    client.solve_times.extend([0.2] * 10)
+    assert client.first_poll_delay() == 1.0
+    assert client.poll_interval() == 1.0
+    client.solve_times.clear()
+    client.solve_times.extend([1, 1, 1, 1, 1, 100, 100, 100, 100, 100])
+    assert client.poll_interval() == 5.0
+
+
+def test_first_poll_adapts_to_solve_time():
+    fake = CapSolver(solve_time=0.3)
+
+    async def scenario(client):
+        warmup = [await client.solve() for _ in range(5)]
+        polls = fake.polls
+        token = await client.solve()
+        return warmup, token, fake.polls - polls, client.first_poll_delay()
+
+    warmup, token, polls, delay = run_client(fake, 5, scenario, min_interval=0.05, max_interval=0.5, default_interval=0.1)
+    assert all(warmup)
+    assert token == "token-6"
+    # Polled every 0.1s while warming up; once the solve time is known the first
+    # poll waits for it and the answer is there on the first or second call.
+    assert 0.3 <= delay < 0.5
+    assert polls <= 2
+
+
+def test_concurrent_solves_share_one_loop():
+    fake = CapSolver(solve_time=0.2)
+
+    async def scenario(client):
+        sessions, loops = set(), set()
+        get_session, ensure_loop = client.get_session, client._ensure_loop
+
+        def recording_session():
+            session = get_session()
+            sessions.add(session)
+            return session
+
+        def recording_loop():
+            ensure_loop()
+            loops.add(client.loop_task)
+
+        client.get_session, client._ensure_loop = recording_session, recording_loop
+        tokens = await asyncio.gather(*(client.solve() for _ in range(10)))
+        return tokens, sessions, loops
+
+    tokens, sessions, loops = run_client(fake, 5, scenario, min_interval=0.05, default_interval=0.1)
+    assert sorted(tokens) == sorted(f"token-{n}" for n in range(1, 11))
+    assert len(sessions) == 1
+    assert len(loops) == 1
+
+
+def test_slow_poll_does_not_hold_back_others():
+    # Task 1's poll hangs; the other solves still finish on time.
+    fake = CapSolver(solve_time=0.1, stall={"1"}, stall_time=1.0)
+
+    async def scenario(client):
+        first = asyncio.create_task(client.solve())
+        await asyncio.sleep(0.01)
+        started = time.monotonic()
+        others = await asyncio.gather(*(client.solve() for _ in range(3)))
+        elapsed = time.monotonic() - started
+        return await first, others, elapsed
+
+    first, others, elapsed = run_client(fake, 5, scenario, min_interval=0.05, default_interval=0.1)
+    assert first == "token-1"
+    assert all(others)
+    assert elapsed < 0.5
+
+
+def test_gives_up_at_the_deadline():
+    fake = CapSolver(solve_time=None)
+
+    async def scenario(client):
+        started = time.monotonic()
+        token = await client.solve()
+        return token, time.monotonic() - started, dict(client.pending)
+
+    token, elapsed, pending = run_client(fake, 0.3, scenario, min_interval=0.05, default_interval=0.05)
+    assert token is None
+    assert 0.3 <= elapsed < 0.6
+    assert pending == {}
+    assert fake.polls > 1
+
+
+def test_failed_task_returns_none():
+    fake = CapSolver(solve_time=1, fail=True)
+
+    async def scenario(client):
+        started = time.monotonic()
+        return await client.solve(), time.monotonic() - started
+
+    token, elapsed = run_client(fake, 5, scenario, default_interval=0.05)
+    assert token is None
+    assert elapsed < 0.5
+    assert fake.polls == 1
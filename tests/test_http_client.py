@@ -0,0 +1,156 @@
+# test_http_client.py (circuit breakers, hedging and budgets against a local server)
+import asyncio
+import time
+import pytest
+from aiohttp import web
+import http_client
+from circuit import CircuitBreaker, breakers, CLOSED, HALF_OPEN, OPEN
+from conftest import serve
+
+
+class Upstream:
+    # Answers 503 while `failing`; the first `stall_first` calls hang for `stall` seconds.
+    def __init__(self, failing=False, stall=0.0, stall_first=0, delay=0.0):
+        self.failing = failing
+        self.stall = stall
+        self.stall_first = stall_first
+        self.delay = delay
+        self.calls = 0
+
+    async def handle(self, request):
+        self.calls += 1
+        call = self.calls
+        if call <= self.stall_first:
+            await asyncio.sleep(self.stall)
+        elif self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failing:
+            return web.Response(status=503, text="down")
+        return web.Response(text=f"answer {call}")
+
+
+class RecordingBreaker(CircuitBreaker):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.releases = 0
+
+    def release(self):
+        self.releases += 1
+        super().release()
+
+
+def install_breaker(name, failures=2, cooldown=0.3, cls=CircuitBreaker):
+    breaker = breakers.breakers[(name, "status")] = cls(name, "status", failures, cooldown)
+    return breaker
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await http_client.close()
+    return asyncio.run(main())
+
+
+def test_breaker_opens_probes_and_closes():
+    upstream = Upstream(failing=True)
+    breaker = install_breaker("breaker-test")
+
+    async def scenario():
+        async with serve(web.get("/", upstream.handle)) as url:
+            def get():
+                return http_client.get(url + "/", upstream="breaker-test", endpoint="status", retries=0)
+
+            for _ in range(2):
+                assert (await get()).status_code == 503
+            assert breaker.state == OPEN
+
+            # Open: refused without reaching the server.
+            with pytest.raises(http_client.CircuitOpen) as refused:
+                await get()
+            assert refused.value.retry_after > 0
+            assert upstream.calls == 2
+
+            # After the cooldown one probe goes through; others are refused meanwhile.
+            await asyncio.sleep(0.35)
+            upstream.failing = False
+            upstream.delay = 0.2
+            probe = asyncio.create_task(get())
+            await asyncio.sleep(0.05)
+            assert breaker.state == HALF_OPEN
+            with pytest.raises(http_client.CircuitOpen):
+                await get()
+            assert (await probe).status_code == 200
+            assert breaker.state == CLOSED
+            assert upstream.calls == 3
+
+    run(scenario())
+
+
+def test_failed_probe_reopens():
+    upstream = Upstream(failing=True)
+    breaker = install_breaker("reopen-test")
+
+    async def scenario():
+        async with serve(web.get("/", upstream.handle)) as url:
+            for _ in range(2):
+                await http_client.get(url + "/", upstream="reopen-test", endpoint="status", retries=0)
+            await asyncio.sleep(0.35)
+            assert (await http_client.get(url + "/", upstream="reopen-test", endpoint="status", retries=0)).status_code == 503
+            assert breaker.state == OPEN
+            assert not breaker.probing
+
+    run(scenario())
+
+
+def test_hedge_wins_and_loser_is_released():
+    upstream = Upstream(stall=1.0, stall_first=1)
+    breaker = install_breaker("hedge-test", cls=RecordingBreaker)
+    wins = http_client.hedge_wins.values.get(("hedge-test", "status"), 0)
+
+    async def scenario():
+        async with serve(web.get("/", upstream.handle)) as url:
+            started = time.monotonic()
+            response = await http_client.get(url + "/", upstream="hedge-test", endpoint="status", retries=0, hedge=0.1)
+            return response, time.monotonic() - started
+
+    response, elapsed = run(scenario())
+    assert response.text == "answer 2"
+    assert elapsed < 0.8
+    assert http_client.hedge_wins.values[("hedge-test", "status")] == wins + 1
+    # The stalled first call was cancelled without counting as a failure.
+    assert breaker.releases == 1
+    assert breaker.failures == 0
+    assert breaker.state == CLOSED
+
+
+def test_first_answer_wins_without_hedge():
+    upstream = Upstream()
+    install_breaker("nohedge-test")
+    hedges = http_client.hedges.values.get(("nohedge-test", "status"), 0)
+
+    async def scenario():
+        async with serve(web.get("/", upstream.handle)) as url:
+            return await http_client.get(url + "/", upstream="nohedge-test", endpoint="status", retries=0, hedge=0.5)
+
+    assert run(scenario()).text == "answer 1"
+    assert upstream.calls == 1
+    assert http_client.hedges.values.get(("nohedge-test", "status"), 0) == hedges
+
+
+def test_budget_expiry_counts_as_failure():
+    upstream = Upstream(stall=1.0, stall_first=1)
+    breaker = install_breaker("budget-test")
+
+    async def scenario():
+        async with serve(web.get("/", upstream.handle)) as url:
+            started = time.monotonic()
+            with pytest.raises(http_client.RequestError, match="budget"):
+                await http_client.get(url + "/", upstream="budget-test", endpoint="status", retries=0, budget=0.2)
+            return time.monotonic() - started
+
+    assert run(scenario()) < 0.8
+    assert breaker.failures == 1
+    assert breaker.state == CLOSED
+
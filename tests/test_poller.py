@@ -0,0 +1,62 @@
+# test_poller.py (invoice polling past the local expiry)
+import asyncio
+from poller import InvoicePoller
+
+
+def run_poller(paid_after_checks, expiry, give_up, duration):
+    checks, expired = [], []
+
+    async def check(invoice_id, hoodpay_id):
+        checks.append(invoice_id)
+        return len(checks) >= paid_after_checks
+
+    async def expire(invoice_id):
+        expired.append(invoice_id)
+
+    async def main():
+        poller = InvoicePoller(check, expire, concurrency=2, expiry=expiry, give_up=give_up,
+                               min_interval=0.02, max_interval=0.1, backoff=0.5)
+        poller.add("inv", "hp")
+        await asyncio.sleep(duration)
+        await poller.stop()
+        return len(poller)
+
+    left = asyncio.run(main())
+    return checks, expired, left
+
+
+def test_late_payment_after_expiry_is_still_seen():
+    # Checks keep going past the 0.1s expiry until the invoice is reported paid.
+    checks, expired, left = run_poller(paid_after_checks=8, expiry=0.1, give_up=10, duration=0.8)
+    assert len(checks) == 8
+    assert expired == []
+    assert left == 0
+
+
+def test_open_invoice_expires_at_give_up():
+    checks, expired, left = run_poller(paid_after_checks=1000, expiry=0.1, give_up=0.5, duration=0.8)
+    assert expired == ["inv"]
+    assert left == 0
+
+
+def test_discarded_invoice_is_not_checked():
+    checks = []
+
+    async def check(invoice_id, hoodpay_id):
+        checks.append(invoice_id)
+        return False
+
+    async def expire(invoice_id):
+        pass
+
+    async def main():
+        poller = InvoicePoller(check, expire, concurrency=2, expiry=1, give_up=1,
+                               min_interval=0.02, max_interval=0.1, backoff=0.5)
+        poller.add("inv", "hp")
+        poller.discard("inv")
+        await asyncio.sleep(0.1)
+        await poller.stop()
+        return poller.inflight
+
+    assert asyncio.run(main()) == set()
+    assert checks == []
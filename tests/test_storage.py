@@ -0,0 +1,24 @@
+# test_storage.py (the three store backends behave the same)
+import pytest
+from storage import JsonStore, SqliteStore, JournalStore
+
+
+@pytest.fixture(params=["json", "sqlite", "journal"])
+def store(request, tmp_path):
+    if request.param == "json":
+        return JsonStore(str(tmp_path / "orders.json"), str(tmp_path / "invoices.json"))
+    if request.param == "sqlite":
+        return SqliteStore(str(tmp_path / "store.db"))
+    return JournalStore(str(tmp_path / "orders.ndjson"), str(tmp_path / "invoices.ndjson"))
+
+
+def order(invoice_id):
+    return {"invoice_id": invoice_id, "user_id": 1, "variant_id": "725392", "quantity": 1, "delivered": False}
+
+
+def test_mark_delivered_counts_each_order_once(store):
+    for invoice_id in ("a", "b", "c", "d"):
+        store.add_order(order(invoice_id))
+    assert store.mark_delivered(["a", "b", "c", "a", "b", "c"]) == 3
+    assert store.mark_delivered(["a", "b"]) == 0
+    assert [o["invoice_id"] for o in store.undelivered_orders()] == ["d"]
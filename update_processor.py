@@ -0,0 +1,44 @@
+# update_processor.py (concurrent update handling with per-user ordering)
+import asyncio
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from log_setup import log_context
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Updates from different users run concurrently; updates from the same user
+    # run one after another so their context.user_data flow stays consistent.
+    # The base class takes its semaphore before do_process_update, which would
+    # let a user's queued updates hold global slots while they wait for that
+    # user's lock. So it gets a limit that is never reached, and the real one is
+    # taken here, after the per-user lock.
+    UNLIMITED = 2 ** 31 - 1
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(self.UNLIMITED)
+        self.semaphore = asyncio.Semaphore(max_concurrent_updates)
+        self.locks = {}
+
+    async def do_process_update(self, update, coroutine):
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self.semaphore:
+                await coroutine
+            return
+
+        entry = self.locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self.semaphore:
+                with log_context(user_id=user.id, update_id=update.update_id):
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[user.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,88 @@
+# webhook.py (Hoodpay payment event receiver)
+import hashlib
+import hmac
+import json
+import logging
+import sys
+from aiohttp import web
+from config import *
+
+logger = logging.getLogger(__name__)
+
+EVENT_STATUSES = {
+    "PAYMENT_COMPLETED": "COMPLETED",
+    "PAYMENT_CANCELLED": "CANCELLED",
+    "PAYMENT_EXPIRED": "EXPIRED",
+}
+
+
+def sign(secret, body):
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def parse_event(payload):
+    event = payload.get("event") or payload.get("type")
+    details = payload.get("forPaymentEvents") or payload.get("data") or payload
+    payment_id = details.get("paymentId") or details.get("id")
+    return EVENT_STATUSES.get(event), payment_id
+
+
+class HoodpayWebhook:
+    # on_status(hoodpay_id, status) is awaited for every verified event we care about.
+    def __init__(self, secret, on_status, path=HOODPAY_WEBHOOK_PATH):
+        self.secret = secret
+        self.on_status = on_status
+        self.path = path
+        self.runner = None
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request):
+        body = await request.read()
+        signature = request.headers.get(HOODPAY_WEBHOOK_SIGNATURE_HEADER, "")
+        if not hmac.compare_digest(signature, sign(self.secret, body)):
+            logger.warning(f"Rejected Hoodpay webhook with bad signature from {request.remote}")
+            return web.Response(status=401)
+
+        try:
+            status, payment_id = parse_event(json.loads(body))
+        except (ValueError, AttributeError):
+            return web.Response(status=400)
+
+        if status and payment_id:
+            logger.info(f"Hoodpay webhook: payment {payment_id} is {status}")
+            await self.on_status(payment_id, status)
+        return web.Response(text="ok")
+
+    async def start(self, host, port):
+        self.runner = web.AppRunner(self.create_app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logger.info(f"Hoodpay webhook listening on {host}:{port}{self.path}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+async def send_sample_event(url, secret, hoodpay_id, event="PAYMENT_COMPLETED"):
+    # Local stand-in for Hoodpay: posts a signed event to a running receiver.
+    import aiohttp
+    body = json.dumps({"event": event, "forPaymentEvents": {"paymentId": hoodpay_id}}).encode()
+    headers = {"Content-Type": "application/json", HOODPAY_WEBHOOK_SIGNATURE_HEADER: sign(secret, body)}
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, data=body, headers=headers) as res:
+            return res.status, await res.text()
+
+
+if __name__ == '__main__':
+    # python webhook.py <hoodpay_id> [PAYMENT_COMPLETED|PAYMENT_CANCELLED|PAYMENT_EXPIRED]
+    import asyncio
+    hoodpay_id = sys.argv[1]
+    event = sys.argv[2] if len(sys.argv) > 2 else "PAYMENT_COMPLETED"
+    url = f"http://127.0.0.1:{HOODPAY_WEBHOOK_PORT}{HOODPAY_WEBHOOK_PATH}"
+    print(asyncio.run(send_sample_event(url, HOODPAY_WEBHOOK_SECRET, hoodpay_id, event)))